@@ -0,0 +1,231 @@
+from agenda_view import DATE_LBL_FORMAT, TIME_LBL_FORMAT
+from bisect import bisect_right
+from calendar_styles import color_class
+import time
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gdk, Gtk
+
+
+class _Cell:
+    """
+    Cached Pango layout of one label, with the style context it is drawn with
+    """
+
+    __slots__ = ("context", "layout", "padding", "width", "height")
+
+    def __init__(self, canvas, classes, text):
+        self.context = canvas.get_label_context(classes)
+        self.layout = canvas.create_pango_layout(text)
+        self.layout.set_font_description(self.context.get_property("font", Gtk.StateFlags.NORMAL))
+        self.padding = self.context.get_padding(Gtk.StateFlags.NORMAL)
+        width, height = self.layout.get_pixel_size()
+        self.width = width + self.padding.left + self.padding.right
+        self.height = height + self.padding.top + self.padding.bottom
+
+    def draw(self, cr, x, y):
+        Gtk.render_layout(self.context, cr, x + self.padding.left, y + self.padding.top, self.layout)
+
+
+class _CanvasRow:
+    """
+    Date header (one cell spanning both columns) or event row (time and title cells)
+    """
+
+    __slots__ = ("cells", "height", "top", "html_link", "tooltip")
+
+    def __init__(self, cells, html_link=None, tooltip=None):
+        self.cells = cells
+        self.height = max(cell.height for cell in cells)
+        self.top = 0
+        self.html_link = html_link
+        self.tooltip = tooltip
+
+
+class AgendaCanvas(Gtk.DrawingArea):
+    """
+    Agenda drawn onto a single surface instead of a grid of label widgets, see AgendaView
+    for the interface. Each row keeps its Pango layouts for as long as it stays on screen,
+    so a pass over unchanged events does not lay out any text, and the surface is only
+    redrawn when the placed rows change.
+    Rows are styled by the same style.css classes as the labels of AgendaView, through
+    style contexts of virtual labels below this widget. Clicks, the hover cursor and
+    tooltips are hit-tested against the row positions.
+    """
+
+    def __init__(self, on_enter, on_leave):
+        Gtk.DrawingArea.__init__(self)
+        self.on_enter = on_enter
+        self.on_leave = on_leave
+        self._rows = {}  # key -> row of the previous pass, with its layouts
+        self._pass_rows = {}  # key -> row created or kept during the current pass
+        self._placed = []  # rows placed during the current pass, top to bottom
+        self._shown = []  # rows being drawn, top to bottom
+        self._tops = []  # top of each shown row, for hit testing
+        self._seen = {}  # number of times each event key was placed during the current pass
+        self._contexts = {}  # style classes -> style context
+        self._max_height = None  # Height available to the rows, None for no limit
+        self._used_height = 0  # Height of the rows placed during the current pass
+        self._event_height = 0  # Height of the last laid out event row
+        self._time_width = 0  # Width of the time column
+        self._hover = None  # Row with a link under the pointer
+
+        self.add_events(Gdk.EventMask.BUTTON_PRESS_MASK | Gdk.EventMask.POINTER_MOTION_MASK |
+                        Gdk.EventMask.LEAVE_NOTIFY_MASK)
+        self.set_has_tooltip(True)
+        self.connect("button-press-event", self._on_button_press)
+        self.connect("motion-notify-event", self._on_motion)
+        self.connect("leave-notify-event", self._on_leave)
+        self.connect("query-tooltip", self._on_query_tooltip)
+
+    def get_label_context(self, classes):
+        """
+        Style context of a label with the given style classes inside this widget
+        """
+        context = self._contexts.get(classes, None)
+        if context is None:
+            path = self.get_path().copy()
+            position = path.append_type(Gtk.Label)
+            for name in classes:
+                path.iter_add_class(position, name)
+            context = Gtk.StyleContext()
+            context.set_path(path)
+            context.set_parent(self.get_style_context())
+            self._contexts[classes] = context
+        return context
+
+    def set_max_height(self, height):
+        self._max_height = height
+
+    def clear_heights(self):
+        """
+        Forget the style contexts and layouts, e.g. after the CSS font sizes changed
+        """
+        self._contexts = {}
+        self._rows = {}
+        self._event_height = 0
+
+    def begin(self):
+        self._pass_rows = {}
+        self._placed = []
+        self._seen = {}
+        self._used_height = 0
+
+    def add_date(self, date):
+        return self._place(("date", date), lambda: _CanvasRow([_Cell(self, ("lbl", "date-header-lbl"),
+                                                                           date.strftime(DATE_LBL_FORMAT))]),
+                           reserve=self._event_height)
+
+    def add_event(self, event):
+        key = ("event", event.id, event.updated, event.color, event.also_in)
+        # The same event can still be shown more than once, e.g. when it has no iCalUID to collapse its copies
+        count = self._seen.get(key, 0)
+        self._seen[key] = count + 1
+        return self._place(key + (count,), lambda: self._event_row(event))
+
+    def finish(self):
+        """
+        Drop the layouts of the rows that were not placed and redraw if anything moved
+        """
+        self._rows = self._pass_rows
+        if [id(row) for row in self._placed] == [id(row) for row in self._shown]:
+            return
+        self._shown = self._placed
+        self._tops = [row.top for row in self._shown]
+        event_rows = [row for row in self._shown if len(row.cells) == 2]
+        self._time_width = max((row.cells[0].width for row in event_rows), default=0)
+        width = max([self._time_width + row.cells[1].width for row in event_rows] +
+                    [row.cells[0].width for row in self._shown if len(row.cells) == 1], default=0)
+        self._hover = None
+        self.set_size_request(width, self._used_height)
+        self.queue_draw()
+
+    def _event_row(self, event):
+        color = color_class(event.color)
+        time_classes = ("lbl", "event-time-lbl") + ((color,) if color is not None else ())
+        title_classes = ("lbl", "event-title-lbl") + ((color,) if color is not None else ())
+        ev_time = "" if event.all_day else event.start.strftime(TIME_LBL_FORMAT)
+
+        location = event.location if event.location is not None else "(No location)"
+        tooltip_text = "Location: {}".format(location)
+        if event.organizer is not None:
+            tooltip_text = "{}\nOrganizer: {}".format(tooltip_text, event.organizer)
+        if event.also_in:
+            tooltip_text = "{}\nAlso in: {}".format(tooltip_text, ", ".join(event.also_in))
+
+        row = _CanvasRow([_Cell(self, time_classes, ev_time), _Cell(self, title_classes, event.summary)],
+                         event.html_link, tooltip_text)
+        self._event_height = row.height
+        return row
+
+    def _place(self, key, create, reserve=0):
+        row = self._rows.get(key, None)
+        if row is None:
+            row = create()
+        if self._max_height is not None and self._used_height + row.height + reserve > self._max_height:
+            return False
+        row.top = self._used_height
+        self._used_height += row.height
+        self._pass_rows[key] = row
+        self._placed.append(row)
+        return True
+
+    def do_draw(self, cr):
+        visible, clip = Gdk.cairo_get_clip_rectangle(cr)
+        for row in self._shown:
+            if visible and (row.top + row.height <= clip.y or row.top >= clip.y + clip.height):
+                continue
+            if len(row.cells) == 1:
+                row.cells[0].draw(cr, 0, row.top)
+            else:
+                time_cell, title_cell = row.cells
+                time_cell.draw(cr, self._time_width - time_cell.width, row.top)  # Right aligned
+                title_cell.draw(cr, self._time_width, row.top)
+        return False
+
+    def _row_at(self, x, y):
+        """
+        Event row whose title is at the given position, or None
+        """
+        i = bisect_right(self._tops, y) - 1
+        if i < 0:
+            return None
+        row = self._shown[i]
+        if y >= row.top + row.height or len(row.cells) != 2:
+            return None
+        if not self._time_width <= x < self._time_width + row.cells[1].width:
+            return None
+        return row
+
+    def _on_button_press(self, widget, event):
+        row = self._row_at(event.x, event.y)
+        if row is not None and row.html_link is not None:
+            Gtk.show_uri(None, row.html_link, time.time())
+        return False
+
+    def _on_motion(self, widget, event):
+        row = self._row_at(event.x, event.y)
+        if row is not None and row.html_link is None:
+            row = None
+        if row is not None and self._hover is None:
+            self.on_enter(widget, event)
+        elif row is None and self._hover is not None:
+            self.on_leave(widget, event)
+        self._hover = row
+        return False
+
+    def _on_leave(self, widget, event):
+        if self._hover is not None:
+            self._hover = None
+            self.on_leave(widget, event)
+        return False
+
+    def _on_query_tooltip(self, widget, x, y, keyboard_mode, tooltip):
+        row = self._row_at(x, y)
+        if row is None:
+            return False
+        tooltip.set_text(row.tooltip)
+        area = Gdk.Rectangle()
+        area.x, area.y, area.width, area.height = self._time_width, row.top, row.cells[1].width, row.height
+        tooltip.set_tip_area(area)
+        return True
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""
+Headless agenda for scripts and login hooks.
+Prints the events saved by the running Desktop Agenda application after each load,
+as text grouped by date or as JSON, without importing GTK or the Google client libraries.
+
+python agenda_cli.py
+python agenda_cli.py --days 1 --json
+python agenda_cli.py --sync     # Sync with the calendars first, also without GTK
+python agenda_cli.py --sync --authorize     # Also authorize accounts without a valid token
+
+While Desktop Agenda is running, it is the only one syncing: --sync then prints the
+events it holds in memory, queried through its socket (see QueryService).
+"""
+
+from atomic_file import atomic_write
+from calendar_event import CalendarEvent
+from calendar_provider import CalendarProvider
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+import argparse
+import json
+import os.path
+import socket
+import sys
+import time
+
+PREFS_DIR = os.path.expanduser("~/.dags")
+PREFS_FILE = "preferences.json"
+SNAPSHOT_FILE = os.path.join(PREFS_DIR, "agenda.json")
+
+QUERY_TIMEOUT = 5  # Seconds to wait for the running application to answer
+
+# Same formats as the agenda view
+DATE_LBL_FORMAT = "%A, %B %-d, %Y"
+TIME_LBL_FORMAT = "%-I:%M"
+
+
+def save_snapshot(events, path=SNAPSHOT_FILE):
+    """
+    Save the loaded events for the headless agenda
+    """
+    snapshot = {"saved": datetime.now().astimezone().isoformat(), "events": [event.to_dict() for event in events]}
+    try:
+        with atomic_write(path) as f:
+            json.dump(snapshot, f)
+    except OSError as err:
+        print(f"Failed to save agenda snapshot {path}: {err}")
+
+
+def load_snapshot(path=SNAPSHOT_FILE):
+    """
+    Return the events of the last saved snapshot, or None when there is none
+    """
+    try:
+        with open(path) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return [CalendarEvent.from_dict(event) for event in snapshot["events"]]
+
+
+def load_preferences():
+    """
+    Read the preferences file without the GTK preferences window, missing values keep their defaults
+    """
+    prefs = {"queryDays": 7, "queryLimit": 20, "accounts": [], "icsFiles": []}
+    try:
+        with open(os.path.join(PREFS_DIR, PREFS_FILE)) as f:
+            prefs.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    return prefs
+
+
+def sync(prefs, days, max_results, authorize=False):
+    """
+    Fetch the events of every configured Google account and calendar file, like the application does.
+    With `authorize`, the accounts without a valid token are authorized in the browser first.
+    """
+    from calendar_provider import Agenda
+    from google_calendar import GoogleCalendar
+    from ics_calendar import IcsCalendar
+
+    agenda = Agenda([GoogleCalendar(account=account) for account in [None] + prefs["accounts"]] +
+                    [IcsCalendar(path) for path in prefs["icsFiles"]], backoff=False)
+    # The providers report their failures on stdout, which is kept for the agenda itself, e.g. --json
+    with redirect_stdout(sys.stderr):
+        events = agenda.fetch_events(days=days, max_results=max_results)
+        unauthorized = [provider for provider in agenda.providers
+                        if isinstance(provider, GoogleCalendar) and provider.needs_authorization()]
+        if unauthorized and authorize:
+            for provider in unauthorized:
+                provider.authorize()
+            events = agenda.fetch_events(days=days, max_results=max_results)
+        elif unauthorized:
+            print("{} not authorized, authorize with: python agenda_cli.py --sync --authorize".format(
+                ", ".join(provider.name for provider in unauthorized)))
+    save_snapshot(events)
+    return events
+
+
+def query_running(request):
+    """
+    Send a request to the query service of the running Desktop Agenda application.
+    Returns its reply, or None when no instance answers.
+    """
+    from query_service import socket_path
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(QUERY_TIMEOUT)
+    data = b""
+    try:
+        client.connect(socket_path())
+        client.sendall((json.dumps(request) + "\n").encode())
+        while not data.endswith(b"\n"):
+            chunk = client.recv(64 * 1024)
+            if not chunk:
+                break
+            data += chunk
+    except OSError:
+        return None
+    finally:
+        client.close()
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+def fetch_running(days):
+    """
+    Return the events of the next `days` days held by the running application, or None when none is running
+    """
+    now = datetime.now().astimezone()
+    reply = query_running({"query": "range", "start": now.isoformat(),
+                           "end": (now + timedelta(days=days)).isoformat()})
+    if reply is None or "events" not in reply:
+        return None
+    return [CalendarEvent.from_dict(event) for event in reply["events"]]
+
+
+def print_text(calendar, since):
+    def date_handler(date):
+        print(date.strftime(DATE_LBL_FORMAT))
+        return True
+
+    def event_handler(event):
+        ev_time = "" if event.all_day else event.start.strftime(TIME_LBL_FORMAT)
+        location = f" ({event.location})" if event.location is not None else ""
+        print(f"  {ev_time:>5}  {event.summary}{location}")
+        return True
+
+    calendar.get_events(date_handler, event_handler, since=since)
+
+
+def main():
+    prefs = load_preferences()
+    parser = argparse.ArgumentParser(description="Print the Desktop Agenda without the desktop")
+    parser.add_argument("--days", type=int, default=prefs["queryDays"], help="Days to show")
+    parser.add_argument("--limit", type=int, default=prefs["queryLimit"], help="Max events per calendar")
+    parser.add_argument("--json", action="store_true", help="Print the events as JSON")
+    parser.add_argument("--sync", action="store_true", help="Sync with the calendars before printing")
+    parser.add_argument("--authorize", action="store_true",
+                        help="With --sync, authorize the Google accounts without a valid token in the browser")
+    args = parser.parse_args()
+
+    events = None
+    if args.sync:
+        # Two processes syncing would share the event stores, tokens and caches of ~/.dags
+        events = fetch_running(args.days)
+        if events is not None:
+            print("Desktop Agenda is running and keeps the agenda in sync, showing its events", file=sys.stderr)
+        else:
+            events = sync(prefs, args.days, args.limit, authorize=args.authorize)
+    else:
+        events = load_snapshot()
+    if events is None:
+        print("No saved agenda, start Desktop Agenda or use --sync", file=sys.stderr)
+        return 1
+
+    now = time.time()
+    calendar = CalendarProvider()
+    calendar.set_events(events)
+    calendar.set_events(calendar.index.limited(now, now + args.days * 24 * 60 * 60, args.limit))
+    if args.json:
+        json.dump([event.to_dict() for event in calendar.index], sys.stdout, indent=2)
+        print()
+    else:
+        print_text(calendar, now)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+from calendar_styles import color_class
+import time
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+
+DATE_LBL_FORMAT = "%A, %B %-d, %Y"
+TIME_LBL_FORMAT = "%-I:%M"
+
+
+class _DateRow:
+    """
+    Date section header spanning both columns of the agenda grid
+    """
+
+    def __init__(self, view):
+        self.top = None
+        self.height = None
+        self.lbl = Gtk.Label(xalign=0)
+        self.lbl.get_style_context().add_class("lbl")
+        self.lbl.get_style_context().add_class("date-header-lbl")
+        self.cells = [(self.lbl, 0, 2)]
+
+    def update(self, date):
+        self.lbl.set_text(date.strftime(DATE_LBL_FORMAT))
+
+
+class _EventRow:
+    """
+    Time and title labels of a calendar event.
+    The title has a mouse-over tooltip containing the location and name of the meeting
+    organizer, and the other calendars of a shared meeting, and a click handler to open
+    the event in a web browser.
+    Signal handlers are connected once and read the current event of the row,
+    so a row can be reused for another event.
+    """
+
+    def __init__(self, view):
+        self.top = None
+        self.height = None
+        self.html_link = None
+        self.color_class = None
+
+        self.time_lbl = Gtk.Label(xalign=0)
+        self.time_lbl.set_halign(Gtk.Align.END)
+        self.time_lbl.get_style_context().add_class("lbl")
+        self.time_lbl.get_style_context().add_class("event-time-lbl")
+
+        self.title_lbl = Gtk.Label(xalign=0)
+        self.title_lbl.get_style_context().add_class("lbl")
+        self.title_lbl.get_style_context().add_class("event-title-lbl")
+
+        # Create a container that will handle user interaction
+        self.event_box = Gtk.EventBox()
+        self.event_box.connect("button-press-event", self.lbl_click_handler)
+        # The mouse enter and leave events need to pass through to the main window
+        self.event_box.connect("enter-notify-event", view.on_enter)
+        self.event_box.connect("leave-notify-event", view.on_leave)
+        self.event_box.add(self.title_lbl)
+
+        self.cells = [(self.time_lbl, 0, 1), (self.event_box, 1, 1)]
+
+    def update(self, event):
+        title = event.summary
+        location = event.location if event.location is not None else "(No location)"
+        ev_time = "" if event.all_day else event.start.strftime(TIME_LBL_FORMAT)
+
+        self.html_link = event.html_link
+
+        self.time_lbl.set_text(ev_time)
+        self.title_lbl.set_text(title)
+
+        # The calendar color comes from the generated stylesheet (see CalendarStyles)
+        color = color_class(event.color)
+        if color != self.color_class:
+            for lbl in (self.time_lbl, self.title_lbl):
+                if self.color_class is not None:
+                    lbl.get_style_context().remove_class(self.color_class)
+                if color is not None:
+                    lbl.get_style_context().add_class(color)
+            self.color_class = color
+
+        # Set tooltip
+        tooltip_text = "Location: {}".format(location)
+        if event.organizer is not None:
+            tooltip_text = "{}\nOrganizer: {}".format(tooltip_text, event.organizer)
+        if event.also_in:
+            tooltip_text = "{}\nAlso in: {}".format(tooltip_text, ", ".join(event.also_in))
+        self.title_lbl.set_tooltip_text(tooltip_text)
+
+    def lbl_click_handler(self, widget, event):
+        if self.html_link is not None:
+            Gtk.show_uri(None, self.html_link, time.time())
+
+
+class AgendaView(Gtk.Grid):
+    """
+    Grid of date headers and event rows that is updated in place.
+    Each pass over the events is bracketed by begin() and finish(). Rows are keyed by
+    event id and updated timestamp, so rows of unchanged events are kept (and only moved
+    when their position changes), changed events get a new row, and rows that are no
+    longer shown are detached and pooled to be reused by later passes.
+    When a maximum height is set, rows that would extend past it are not placed and
+    add_date()/add_event() return False so the handlers can cancel further processing.
+    """
+
+    POOL_SIZE = 50  # Max number of detached rows kept per row type
+
+    def __init__(self, on_enter, on_leave):
+        Gtk.Grid.__init__(self)
+        self.on_enter = on_enter
+        self.on_leave = on_leave
+        self._rows = {}  # key -> row
+        self._pools = {_DateRow: [], _EventRow: []}
+        self._placed = []  # keys placed during the current pass
+        self._seen = {}  # number of times each event key was placed during the current pass
+        self._max_height = None  # Height available to the rows, None for no limit
+        self._used_height = 0  # Height of the rows placed during the current pass
+        self._event_height = 0  # Height of the last measured event row
+
+    def set_max_height(self, height):
+        """
+        Limit the height of the rows, e.g. to the part of the monitor below the clock
+        """
+        self._max_height = height
+
+    def clear_heights(self):
+        """
+        Forget the measured row heights, e.g. after the CSS font sizes changed
+        """
+        for row in self._rows.values():
+            row.height = None
+        for pool in self._pools.values():
+            for row in pool:
+                row.height = None
+        self._event_height = 0
+
+    def begin(self):
+        """
+        Start a new pass over the events
+        """
+        self._placed = []
+        self._seen = {}
+        self._used_height = 0
+
+    def add_date(self, date):
+        """
+        Place a date header for the given date.
+        The header is only placed if there is also room for an event below it.
+        Returns False when it does not fit so it can be returned from a date handler.
+        """
+        return self._place(("date", date), _DateRow, date, reserve=self._event_height)
+
+    def add_event(self, event):
+        """
+        Place a row for the given CalendarEvent.
+        Returns False when it does not fit so it can be returned from an event handler.
+        """
+        key = ("event", event.id, event.updated, event.color, event.also_in)
+        # The same event can still be shown more than once, e.g. when it has no iCalUID to collapse its copies
+        count = self._seen.get(key, 0)
+        self._seen[key] = count + 1
+        return self._place(key + (count,), _EventRow, event)
+
+    def finish(self):
+        """
+        Remove the rows that were not placed during the current pass
+        """
+        placed = set(self._placed)
+        for key in [key for key in self._rows if key not in placed]:
+            row = self._rows.pop(key)
+            for widget, left, width in row.cells:
+                self.remove(widget)
+            row.top = None
+            pool = self._pools[type(row)]
+            if len(pool) < self.POOL_SIZE:
+                pool.append(row)
+
+    def _place(self, key, row_type, data, reserve=0):
+        pool = self._pools[row_type]
+        row = self._rows.get(key)
+        created = row is None
+        if created:
+            row = pool.pop() if pool else row_type(self)
+            row.update(data)
+            row.height = None
+
+        if row.height is None:
+            row.height = max(widget.get_preferred_height()[1] for widget, left, width in row.cells)
+            if row_type is _EventRow:
+                self._event_height = row.height
+        if self._max_height is not None and self._used_height + row.height + reserve > self._max_height:
+            if created and len(pool) < self.POOL_SIZE:
+                pool.append(row)
+            return False
+
+        top = len(self._placed)
+        self._placed.append(key)
+        self._used_height += row.height
+        if created:
+            for widget, left, width in row.cells:
+                self.attach(widget, left, top, width, 1)
+                widget.show_all()
+            self._rows[key] = row
+        elif row.top != top:
+            for widget, left, width in row.cells:
+                self.child_set_property(widget, "top-attach", top)
+        row.top = top
+        return True
@@ -0,0 +1,20 @@
+from contextlib import contextmanager
+import os
+
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """
+    Open a temporary file next to `path` for writing, which replaces `path` once it is complete.
+    Readers such as file monitors and other processes never see a partial file, and neither
+    does the next start after a crash.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
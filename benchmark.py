@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+Benchmark suite for the Desktop Agenda application, run against the local fake Calendar API
+server so results do not depend on the network or on a Google account.
+
+For each size it reports:
+  full sync     - GoogleCalendar.fetch_events with an empty event store
+  delta sync    - GoogleCalendar.fetch_events after a few events changed (sync tokens)
+  parse/sort    - reading the window from the event store into sorted CalendarEvent records
+  render        - one MainWindow.render_agenda pass over the events
+  peak memory   - peak Python allocations during the full sync, from tracemalloc
+  transferred   - response bytes sent by the fake server for the full and delta syncs, after compression
+
+Rendering uses a real AgendaView (or AgendaCanvas with --render canvas) when GTK and a display
+are available (e.g. under xvfb-run), otherwise it is stubbed with handlers that only format the row text.
+
+python benchmark.py
+xvfb-run python benchmark.py --render gtk --latency 0.05
+xvfb-run python benchmark.py --render canvas
+"""
+
+from fake_calendar_server import FakeCalendarData, FakeCalendarServer
+from google_calendar import GoogleCalendar
+import argparse
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+DEFAULT_SIZES = [10, 100, 1000, 10000]
+ROW_FORMAT = "{:>8} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}"
+
+
+class StubRenderer:
+    """
+    Stand-in for AgendaView that does the per-row string formatting without creating widgets
+    """
+
+    def __init__(self):
+        self.rows = []
+
+    def begin(self):
+        self.rows = []
+
+    def add_date(self, date):
+        self.rows.append(date.strftime("%A, %B %-d, %Y"))
+        return True
+
+    def add_event(self, event):
+        ev_time = "" if event.all_day else event.start.strftime("%-I:%M")
+        self.rows.append((ev_time, event.summary, event.location, event.organizer))
+        return True
+
+    def finish(self):
+        pass
+
+
+def create_renderer(mode):
+    """
+    Return an object with the AgendaView interface, or None when GTK rendering is unavailable
+    """
+    if mode == "stub":
+        return StubRenderer()
+    try:
+        import gi
+        gi.require_version("Gtk", "3.0")
+        from gi.repository import Gtk
+        from agenda_canvas import AgendaCanvas
+        from agenda_view import AgendaView
+        if not Gtk.init_check(None)[0]:
+            raise RuntimeError("no display")
+    except (ImportError, ValueError, RuntimeError) as err:
+        if mode in ("gtk", "canvas"):
+            raise SystemExit(f"GTK rendering is not available: {err}")
+        return StubRenderer()
+
+    window = Gtk.OffscreenWindow()
+    view = (AgendaCanvas if mode == "canvas" else AgendaView)(lambda *args: False, lambda *args: False)
+    window.add(view)
+    window.show_all()
+    return view
+
+
+def render(calendar, renderer):
+    """
+    Same pass as MainWindow.render_agenda, followed by a size allocation when rendering with GTK
+    """
+    renderer.begin()
+    calendar.get_events(renderer.add_date, renderer.add_event)
+    renderer.finish()
+    if not isinstance(renderer, StubRenderer):
+        from gi.repository import Gtk
+        renderer.get_toplevel().check_resize()
+        while Gtk.events_pending():
+            Gtk.main_iteration()
+
+
+def run(size, args, renderer):
+    calendars = max(1, min(args.calendars, size))
+    data = FakeCalendarData(calendars=calendars, events=size // calendars, days=args.days)
+    server = FakeCalendarServer(data, latency=args.latency, error_rate=args.error_rate).start()
+    data_dir = tempfile.mkdtemp(prefix="dags-benchmark-")
+    try:
+        from google.auth.credentials import AnonymousCredentials
+        calendar = GoogleCalendar(data_dir=data_dir, credentials=AnonymousCredentials(), api_endpoint=server.url)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        events = calendar.fetch_events(days=args.days, max_results=size)
+        full_sync = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        data.touch(count=max(1, size // 100))
+        start = time.perf_counter()
+        calendar.fetch_events(days=args.days, max_results=size)
+        delta_sync = time.perf_counter() - start
+
+        start = time.perf_counter()
+        events = calendar.load_cached_events(days=args.days, max_results=size)
+        parse_sort = time.perf_counter() - start
+
+        calendar.set_events(events)
+        start = time.perf_counter()
+        render(calendar, renderer)
+        render_time = time.perf_counter() - start
+
+        print(ROW_FORMAT.format(len(events), "{:.1f} ms".format(full_sync * 1000),
+                                "{:.1f} ms".format(delta_sync * 1000), "{:.1f} ms".format(parse_sort * 1000),
+                                "{:.1f} ms".format(render_time * 1000),
+                                "{:.1f} MiB".format(peak_memory / (1024 * 1024)),
+                                "{:.1f} KiB".format(server.bytes_sent / 1024)))
+    finally:
+        server.stop()
+        shutil.rmtree(data_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Desktop Agenda benchmark suite")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Total number of events")
+    parser.add_argument("--calendars", type=int, default=10, help="Calendars the events are split between")
+    parser.add_argument("--days", type=int, default=30, help="Days the events are spread over")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every API response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a 503 API response")
+    parser.add_argument("--render", choices=["auto", "gtk", "canvas", "stub"], default="auto")
+    args = parser.parse_args()
+
+    renderer = create_renderer(args.render)
+    print(f"Rendering with {type(renderer).__name__}")
+    print(ROW_FORMAT.format("events", "full sync", "delta sync", "parse/sort", "render", "peak memory", "transferred"))
+    for size in args.sizes:
+        run(size, args, renderer)
@@ -0,0 +1,121 @@
+from datetime import datetime, time
+from dateutil.tz import tzlocal
+
+
+class CalendarEvent:
+    """
+    Calendar event parsed once from a Calendar API event resource.
+    Start and end are timezone aware datetimes in the local timezone; all-day events
+    start and end at local midnight. `date` is the local date the event is listed under
+    and `reminders` holds the minutes before the start of each popup reminder.
+    The same meeting shows up in every calendar it was shared with. Its copies have the same
+    `ical_uid` and `original_start` (the timestamp of the instance in its recurring series,
+    or of the start), `rank` tells which copy to show, the lowest, and `also_in` names the
+    other calendars of the shown copy (see Agenda).
+    """
+
+    __slots__ = ("id", "calendar_id", "updated", "summary", "location", "organizer", "html_link",
+                 "start", "end", "all_day", "date", "color", "reminders", "ical_uid", "original_start",
+                 "calendar_name", "rank", "also_in")
+
+    DEFAULT_RANK = 3
+
+    def __init__(self, id, calendar_id, updated, summary, location, organizer, html_link,
+                 start, end, all_day, color, reminders, ical_uid=None, original_start=None,
+                 calendar_name=None, rank=DEFAULT_RANK, also_in=()):
+        self.id = id
+        self.calendar_id = calendar_id
+        self.updated = updated
+        self.summary = summary
+        self.location = location
+        self.organizer = organizer
+        self.html_link = html_link
+        self.start = start
+        self.end = end
+        self.all_day = all_day
+        self.date = start.date()
+        self.color = color
+        self.reminders = reminders
+        self.ical_uid = ical_uid
+        self.original_start = original_start if original_start is not None else start.timestamp()
+        self.calendar_name = calendar_name
+        self.rank = rank
+        self.also_in = also_in
+
+    def __repr__(self):
+        return f"CalendarEvent({self.summary!r}, {self.start.isoformat()})"
+
+    @classmethod
+    def from_api(cls, event, calendar_id=None, color=None, default_reminders=(), start_ts=None, end_ts=None,
+                 calendar_name=None, rank=DEFAULT_RANK):
+        """
+        Build an event from an API event resource.
+        `default_reminders` are the calendar's default reminders, used unless the event overrides them.
+        The start and end are only parsed when their timestamps are not given.
+        """
+        if start_ts is not None and end_ts is not None:
+            start = datetime.fromtimestamp(start_ts, tzlocal())
+            end = datetime.fromtimestamp(end_ts, tzlocal())
+            all_day = "dateTime" not in event["start"]
+        else:
+            start, all_day = cls.parse_time(event["start"])
+            end, _ = cls.parse_time(event.get("end", event["start"]))
+
+        organizer = event.get("organizer", event.get("creator", None))
+        if organizer is not None:
+            organizer = organizer.get("displayName", organizer.get("email", None))
+
+        reminders = event.get("reminders", {})
+        if reminders.get("useDefault", True):
+            reminders = default_reminders
+        else:
+            reminders = reminders.get("overrides", [])
+        popups = tuple(sorted(reminder.get("minutes", 0) for reminder in reminders
+                              if reminder.get("method", None) == "popup" and reminder.get("minutes", 0) > 0))
+
+        # Only instances of recurring events have an original start time
+        original_start = event.get("originalStartTime", None)
+        if original_start is not None:
+            original_start = cls.parse_time(original_start)[0].timestamp()
+
+        return cls(event["id"], calendar_id, event.get("updated", None),
+                   event.get("summary", "(No title)"), event.get("location", None), organizer,
+                   event.get("htmlLink", None), start, end, all_day, color, popups,
+                   event.get("iCalUID", None), original_start, calendar_name, rank)
+
+    @staticmethod
+    def parse_time(field):
+        """
+        Parse the start or end field of an API event resource.
+        Returns the local timezone aware datetime and whether it is an all-day date.
+        """
+        # Imported here because only syncing needs the parser, not painting from the event store
+        from dateutil.parser import isoparse
+
+        date_time = field.get("dateTime", None)
+        if date_time is not None:
+            return isoparse(date_time).astimezone(tzlocal()), False
+        return datetime.combine(isoparse(field["date"]).date(), time.min, tzinfo=tzlocal()), True
+
+    def to_dict(self):
+        """
+        JSON serializable form of the event, with ISO 8601 start and end times
+        """
+        return {"id": self.id, "calendar_id": self.calendar_id, "updated": self.updated,
+                "summary": self.summary, "location": self.location, "organizer": self.organizer,
+                "html_link": self.html_link, "start": self.start.isoformat(), "end": self.end.isoformat(),
+                "all_day": self.all_day, "color": self.color, "reminders": list(self.reminders),
+                "ical_uid": self.ical_uid, "original_start": self.original_start,
+                "calendar_name": self.calendar_name, "rank": self.rank, "also_in": list(self.also_in)}
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build an event from the result of to_dict()
+        """
+        return cls(data["id"], data["calendar_id"], data["updated"], data["summary"], data["location"],
+                   data["organizer"], data["html_link"], datetime.fromisoformat(data["start"]).astimezone(tzlocal()),
+                   datetime.fromisoformat(data["end"]).astimezone(tzlocal()), data["all_day"], data["color"],
+                   tuple(data["reminders"]), data.get("ical_uid", None), data.get("original_start", None),
+                   data.get("calendar_name", None), data.get("rank", cls.DEFAULT_RANK),
+                   tuple(data.get("also_in", ())))
@@ -0,0 +1,310 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from event_index import EventIndex
+import copy
+import heapq
+import math
+import random
+import time
+
+
+class CalendarProvider:
+    """
+    Source of calendar events for the Desktop Agenda application.
+    Subclasses implement fetch_events() and load_cached_events(), which both return
+    CalendarEvent records sorted by start time without modifying the loaded events.
+    The loaded events are replaced with set_events(), which indexes them by time (see
+    EventIndex), and walked with get_events() or queried through `index`.
+    """
+
+    def __init__(self):
+        self.index = EventIndex()
+        self.last_error = None  # Why the last fetch could not reach the source, None if it did
+        # Outcome of the last fetch: the number of changed events of each calendar that was synced
+        # (None when unknown, e.g. after a full sync) and the errors it ran into
+        self.last_sync = ({}, [])
+
+    @property
+    def name(self):
+        """
+        Name of the provider in log messages
+        """
+        return type(self).__name__
+
+    def fetch_events(self, days=7, max_results=30, on_progress=None):
+        """
+        Bring the events of the next `days` days up to date and return them.
+        `on_progress` may be called with partial results before the fetch completes.
+        May block on I/O, so it is run from a background thread (see SyncWorker).
+        """
+        raise NotImplementedError
+
+    def load_cached_events(self, days=7, max_results=30):
+        """
+        Return the events of the next `days` days that are available without any I/O wait
+        """
+        raise NotImplementedError
+
+    def invalidate_metadata(self):
+        """
+        Make the next fetch revalidate any cached metadata, e.g. when the user asks for a refresh
+        """
+        pass
+
+    def close(self):
+        """
+        Release the threads, files and connections of the provider once it is no longer used
+        """
+        pass
+
+    def get_palette(self):
+        """
+        Colors the events of this provider can have, as "#rrggbb" strings
+        """
+        return []
+
+    def load_events(self, date_handler=None, event_handler=None, days=7, max_results=30):
+        """
+        Query the API for calendar events
+        Trigger handlers and return events
+        """
+        self.set_events(self.fetch_events(days=days, max_results=max_results))
+
+        # Call handlers
+        self.get_events(date_handler, event_handler)
+
+        return self.index.events
+
+    def set_events(self, events):
+        """
+        Replace the loaded events with a list previously returned by fetch_events()
+        """
+        self.index = EventIndex(events)
+
+    def get_events(self, date_handler=None, event_handler=None, since=None):
+        """
+        Trigger handlers and return events previously loaded by load_events().
+        With `since` (a timestamp), events that ended before it are skipped.
+        """
+        events = self.index.events if since is None else self.index.overlapping(since, math.inf)
+        cur_date = None
+        for event in events:
+            if event.date != cur_date:
+                cur_date = event.date
+                if date_handler is not None:
+                    if not date_handler(cur_date):  # Allow handlers to cancel further processing, e.g. when full
+                        break
+
+            if event_handler is not None:
+                if not event_handler(event):  # Allow handlers to cancel further processing, e.g. when full
+                    break
+
+        return events
+
+    @staticmethod
+    def get_event_datetime(event):
+        return event.start
+
+
+class Agenda(CalendarProvider):
+    """
+    Merges the events of several calendar providers into one time-ordered agenda.
+    Providers are fetched in parallel, and the merged agenda is reported through
+    `on_progress` as soon as each one finishes, so a slow provider (e.g. an account
+    waiting on a token refresh) does not hold back the others. A fetch waits at most
+    FETCH_DEADLINE for the providers; one that is still fetching then finishes into the
+    agenda later and is not fetched again until it does.
+    A provider that fails keeps contributing the events of its last successful fetch
+    and is skipped with exponential backoff until its next retry, or until reset_backoff().
+    A provider that runs into the API quota counts as failed and backs off from a higher base.
+    The application schedules its syncs no later than the next retry, see retry_delay().
+    """
+
+    BACKOFF_BASE = 60  # Seconds before retrying a provider after its first failure
+    QUOTA_BACKOFF_BASE = 5 * 60  # Seconds before retrying a provider after its first quota error
+    BACKOFF_MAX = 60 * 60  # Max seconds between retries
+    FETCH_DEADLINE = 2 * 60  # Seconds a fetch waits for the providers
+
+    def __init__(self, providers, backoff=True):
+        """
+        `backoff` is False for one-shot fetches such as the headless agenda's, which never retry
+        """
+        CalendarProvider.__init__(self)
+        self.providers = providers
+        self.backoff = backoff
+        self._latest = {}  # provider -> events of its last fetch, possibly partial
+        self._failures = {}  # provider -> number of consecutive failed fetches
+        self._retry_at = {}  # provider -> monotonic time before which the provider is skipped
+        self._running = {}  # provider -> future of its fetch in progress
+        self._pool = None
+
+    def fetch_events(self, days=7, max_results=30, on_progress=None):
+        now = time.monotonic()
+        providers = [provider for provider in self.providers
+                     if self._retry_at.get(provider, 0) <= now and provider not in self._running]
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(thread_name_prefix="agenda-fetch")
+        futures = {}
+        for provider in providers:
+            future = self._pool.submit(self._fetch_provider, provider, days, max_results, on_progress)
+            self._running[provider] = future
+            future.add_done_callback(lambda _, provider=provider: self._running.pop(provider, None))
+            futures[future] = provider
+
+        finished = []
+        try:
+            for future in as_completed(futures, timeout=self.FETCH_DEADLINE):
+                finished.append(futures[future])
+                if on_progress is not None and future.result() and len(futures) > 1:
+                    on_progress(self._merge())
+        except TimeoutError:
+            for future, provider in futures.items():
+                if not future.done():
+                    print(f"{provider.name} is still fetching after {self.FETCH_DEADLINE} s, "
+                          "its events are shown when it finishes")
+                    if on_progress is not None:
+                        future.add_done_callback(lambda _: on_progress(self._merge()))
+
+        changes = {}
+        errors = []
+        for provider in finished:
+            changes.update(provider.last_sync[0])
+            errors.extend(provider.last_sync[1])
+        self.last_sync = (changes, errors)
+        return self._merge()
+
+    def _fetch_provider(self, provider, days, max_results, on_progress):
+        """
+        Fetch the events of one provider, returns whether it succeeded
+        """
+        def progress(events):
+            on_progress(self._merge(provider, events))
+
+        try:
+            self._latest[provider] = provider.fetch_events(days=days, max_results=max_results,
+                                                           on_progress=progress if on_progress is not None else None)
+            error = provider.last_error
+        except Exception as err:
+            error = err
+            provider.last_sync = ({}, [err])
+        quota_error = next((err for err in provider.last_sync[1] if self.is_quota_error(err)), None)
+        if error is None:
+            error = quota_error
+
+        if error is None:
+            self._failures.pop(provider, None)
+            self._retry_at.pop(provider, None)
+            return True
+        if not self.backoff:
+            print(f"Failed to fetch events from {provider.name}: {error}")
+            return False
+        failures = self._failures.get(provider, 0) + 1
+        self._failures[provider] = failures
+        base = self.QUOTA_BACKOFF_BASE if quota_error is not None else self.BACKOFF_BASE
+        # Jitter spreads the retries of providers that failed together, e.g. when going offline
+        delay = min(self.BACKOFF_MAX, base * 2 ** (failures - 1)) * random.uniform(0.8, 1.2)
+        self._retry_at[provider] = time.monotonic() + delay
+        print(f"Failed to fetch events from {provider.name}: {error}, retrying in {delay:.0f} s")
+        return False
+
+    def retry_delay(self):
+        """
+        Seconds until the next retry of a failed provider, or None when no provider is backed off
+        """
+        if not self._retry_at:
+            return None
+        return max(0, min(self._retry_at.values()) - time.monotonic())
+
+    @staticmethod
+    def is_quota_error(err):
+        """
+        Whether an API error reports an exceeded rate limit or quota
+        """
+        status = getattr(getattr(err, "resp", None), "status", None)
+        if status == 429:
+            return True
+        content = getattr(err, "content", b"") or b""
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", "replace")
+        content = content.lower()
+        return status == 403 and ("ratelimitexceeded" in content or "quotaexceeded" in content)
+
+    def reset_backoff(self, provider=None):
+        """
+        Retry a provider, or every provider, on the next fetch even if its backoff has not expired,
+        e.g. when the user asks for a refresh or the system resumes
+        """
+        for backed_off in ([provider] if provider is not None else list(self._retry_at)):
+            self._failures.pop(backed_off, None)
+            self._retry_at.pop(backed_off, None)
+
+    def load_cached_events(self, days=7, max_results=30):
+        for provider in self.providers:
+            self._latest[provider] = provider.load_cached_events(days=days, max_results=max_results)
+        return self._merge()
+
+    def invalidate_metadata(self):
+        for provider in self.providers:
+            provider.invalidate_metadata()
+
+    def set_providers(self, providers):
+        """
+        Replace the providers, closing those that are no longer used once their fetch in progress, if any, ends
+        """
+        removed = [provider for provider in self.providers if provider not in providers]
+        self.providers = providers
+        for provider in removed:
+            future = self._running.get(provider, None)
+            if future is not None:
+                future.add_done_callback(lambda _, provider=provider: self._drop_provider(provider))
+            else:
+                self._drop_provider(provider)
+
+    def _drop_provider(self, provider):
+        self._latest.pop(provider, None)
+        self._failures.pop(provider, None)
+        self._retry_at.pop(provider, None)
+        provider.close()
+
+    def get_palette(self):
+        return [color for provider in self.providers for color in provider.get_palette()]
+
+    def _merge(self, partial_provider=None, partial_events=None):
+        """
+        Merge the latest events of every provider, using `partial_events` for `partial_provider`
+        """
+        streams = []
+        for provider in self.providers:
+            if provider is partial_provider:
+                streams.append(partial_events)
+            else:
+                streams.append(self._latest.get(provider, []))
+        return self.collapse_duplicates(list(heapq.merge(*streams, key=self.get_event_datetime)))
+
+    @staticmethod
+    def collapse_duplicates(events):
+        """
+        Keep one copy of each event shared by several calendars, the one with the lowest rank
+        (the first of them on a tie). The kept copy lists the other calendars in `also_in`.
+        """
+        copies = {}  # (ical_uid, original_start) -> copies of the event, in start order
+        kept = {}  # (ical_uid, original_start) -> copy with the lowest rank so far
+        for event in events:
+            if event.ical_uid is not None:
+                key = (event.ical_uid, event.original_start)
+                copies.setdefault(key, []).append(event)
+                if key not in kept or event.rank < kept[key].rank:
+                    kept[key] = event
+        if len(copies) == sum(len(shared) for shared in copies.values()):
+            return events
+
+        collapsed = []
+        for event in events:
+            key = (event.ical_uid, event.original_start) if event.ical_uid is not None else None
+            if key is None or len(copies[key]) == 1:
+                collapsed.append(event)
+            elif event is kept[key]:
+                event = copy.copy(event)  # The events of the providers are not modified
+                event.also_in = tuple(e.calendar_name for e in copies[key]
+                                      if e is not kept[key] and e.calendar_name is not None)
+                collapsed.append(event)
+        return collapsed
@@ -0,0 +1,46 @@
+import re
+import gi
+gi.require_version("Gtk", "3.0")
+from gi.repository import Gtk
+
+HEX_COLOR_PATTERN = re.compile(r"^#([0-9a-fA-F]{3}|[0-9a-fA-F]{6})$")
+
+
+def color_class(color):
+    """
+    Style class of the labels of a calendar with the given "#rrggbb" color, or None
+    """
+    if color is None or HEX_COLOR_PATTERN.match(color) is None:
+        return None
+    return "calendar-color-" + color[1:].lower()
+
+
+class CalendarStyles:
+    """
+    Generated stylesheet with one style class per calendar color.
+    Event labels get the class of their calendar's color (see color_class()) instead of
+    inline Pango markup, so their text is never parsed as markup. The stylesheet is only
+    regenerated when the palette or the styleCalendarColors preference changes; turning
+    the colors off empties it without touching any label.
+    """
+
+    def __init__(self, screen):
+        self._css = Gtk.CssProvider()
+        self._state = None  # (colors, enabled) of the current stylesheet
+        # Same priority as style.css, the two class selectors take precedence over its .lbl color
+        Gtk.StyleContext.add_provider_for_screen(screen, self._css, Gtk.STYLE_PROVIDER_PRIORITY_USER)
+
+    def update(self, colors, enabled=True):
+        """
+        Generate the classes of the given calendar colors if they or `enabled` changed
+        """
+        state = (frozenset(color.lower() for color in colors if color_class(color) is not None), enabled)
+        if state == self._state:
+            return
+        self._state = state
+
+        rules = []
+        if enabled:
+            for color in sorted(state[0]):
+                rules.append(".lbl.{} {{ color: {}; }}".format(color_class(color), color))
+        self._css.load_from_data("\n".join(rules).encode())
@@ -1,24 +1,39 @@
 #!/usr/bin/env python
 
-from datetime import datetime, timedelta
-from dateutil.parser import parse
+import time
+STARTUP_TIME = time.monotonic()  # Reference point of the startup time measurements
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from agenda_cli import save_snapshot
+from calendar_provider import Agenda
+from calendar_styles import CalendarStyles
+from event_index import EventIndex
 from google_calendar import GoogleCalendar
+from ics_calendar import IcsCalendar
+from query_service import QueryService
+from refresh_policy import RefreshPolicy
+from instrumentation import Metrics
 import os.path
 import prefs
+import sys
+import threading
 import pytz
-# import threading
-import time
 import gi
 gi.require_version("Gtk", "3.0")
 gi.require_version("AppIndicator3", "0.1")
 from gi.repository import Gtk, Gdk, GLib, AppIndicator3
+from agenda_canvas import AgendaCanvas
+from agenda_view import AgendaView
+from reminders import ReminderScheduler
+from sync_worker import SyncWorker
+from timers import WallClockTimers
 
 # TODO: Move these to MainWindow class
 CSS_SOURCE = "style.css"
 CLOCK_TIME_FORMAT = "%-I:%M %p"
 CLOCK_DATE_FORMAT = "%A, %B %-d, %Y"
-CLOCK_UTC_FORMAT = "%Y-%m-%d %-H:%M:%S UTC"
-TIME_LBL_FORMAT = "%-I:%M"
+CLOCK_UTC_FORMAT = "%Y-%m-%d %-H:%M UTC"
 
 
 # TODO: Use Gtk.Application / Gtk.ApplicationWindow instead.
@@ -29,10 +44,10 @@ TIME_LBL_FORMAT = "%-I:%M"
 
 class MainWindow(Gtk.Window):
 
-    def __init__(self):
-        self.row = 0
-        self.event_container = None
+    def __init__(self, query_service=None):
         self.prefs_window = prefs.PrefsWindow()
+        self.metrics = Metrics(enabled=self.prefs_window.get_metrics_enabled(),
+                               export_path=self.prefs_window.get_metrics_export())
 
         # Initialize the taskbar icon
         self.appindicator = AppIndicator3.Indicator.new("desktop-agenda", "gnome-calendar",
@@ -45,23 +60,47 @@ class MainWindow(Gtk.Window):
         item_show_hide.connect("activate", self.show_or_hide)
         item_refresh = Gtk.MenuItem(label="Refresh")
         item_refresh.connect("activate", self.refresh_agenda)
+        item_authorize = Gtk.MenuItem(label="Authorize accounts")
+        item_authorize.connect("activate", self.authorize_accounts)
         item_prefs = Gtk.MenuItem(label="Preferences")
         item_prefs.connect("activate", self.show_prefs)
         item_quit = Gtk.MenuItem(label="Quit")
         item_quit.connect("activate", self.quit)
         menu.append(item_show_hide)
         menu.append(item_refresh)
+        menu.append(item_authorize)
         menu.append(item_prefs)
+        if self.metrics.enabled:
+            item_metrics = Gtk.MenuItem(label="Performance")
+            item_metrics.connect("activate", self.show_metrics)
+            menu.append(item_metrics)
         menu.append(item_quit)
         menu.show_all()
         self.appindicator.set_menu(menu)
 
-        # Create an instance of the GoogleCalendar class
-        # TODO: This can raise an exception
-        #  google.auth.exceptions.RefreshError:
-        #  ('invalid_grant: Bad Request', u'{\n  "error": "invalid_grant",\n  "error_description": "Bad Request"\n}')
-        #  In this case, the token.pickle file needs to be removed
-        self.calendar = GoogleCalendar()
+        # Merge the calendars of every Google account with any local iCalendar files
+        # Authentication is deferred to the first sync, on the sync worker thread. An account without
+        # a valid token is authorized in the browser outside of the syncs, see authorize_accounts()
+        self.calendar = Agenda(self.create_providers())
+        self.authorizing = set()  # Google accounts whose authorization is open in the browser
+        self.authorize_prompted = set()  # Google accounts already asked for authorization
+        self.first_sync_done = False
+        self.refresh_policy = RefreshPolicy()
+        self.refresh_timer = None
+
+        # Superset of the shown events, preference changes that narrow the agenda are served from it
+        self.loaded = EventIndex()
+        self.loaded_days = 0
+        self.loaded_limit = 0
+        self.applied_prefs = self.get_applied_prefs()
+
+        # All API requests are made by the sync worker so the main loop never blocks on the network
+        self.sync_worker = SyncWorker(self.calendar, self.on_events_synced, self.on_events_loaded)
+        self.sync_worker.start()
+
+        self.reminder_scheduler = ReminderScheduler()
+        # Snapshots for the headless agenda (see agenda_cli.py) are written one at a time, off the main loop
+        self.snapshot_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot")
 
         # Initialize the main window
         Gtk.Window.__init__(self)
@@ -78,6 +117,7 @@ class MainWindow(Gtk.Window):
             css = Gtk.CssProvider()
             css.load_from_path(CSS_SOURCE)
             Gtk.StyleContext.add_provider_for_screen(screen, css, Gtk.STYLE_PROVIDER_PRIORITY_USER)
+        self.calendar_styles = CalendarStyles(screen)
 
         # Set window options
         self.set_decorated(False)
@@ -92,36 +132,65 @@ class MainWindow(Gtk.Window):
         self.connect("delete-event", Gtk.main_quit)
         self.connect("enter-notify-event", self.enter_notify)
         self.connect("leave-notify-event", self.leave_notify)
+        self.first_paint_handler = self.connect_after("draw", self.on_first_paint)
 
         # Create window layout
         self.widgets_container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.widgets_container.get_style_context().add_class("container")
         self.add(self.widgets_container)
 
-        clock_container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
-        self.widgets_container.pack_start(clock_container, True, True, 0)
+        self.clock_container = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.widgets_container.pack_start(self.clock_container, True, True, 0)
 
         self.time_lbl = Gtk.Label(xalign=0)
         self.time_lbl.get_style_context().add_class("lbl")
         self.time_lbl.get_style_context().add_class("time-lbl")
-        clock_container.pack_start(self.time_lbl, False, False, 0)
+        self.clock_container.pack_start(self.time_lbl, False, False, 0)
 
         self.date_lbl = Gtk.Label(xalign=0)
         self.date_lbl.get_style_context().add_class("lbl")
         self.date_lbl.get_style_context().add_class("date-lbl")
-        clock_container.pack_start(self.date_lbl, False, False, 0)
+        self.clock_container.pack_start(self.date_lbl, False, False, 0)
 
-        # Update clock and calendar at startup
-        self.update_clock()
-        self.update_agenda(force=True)
+        # Either one label widget per cell, or the whole agenda drawn on a single surface
+        renderer = AgendaCanvas if self.prefs_window.get_renderer() == "canvas" else AgendaView
+        self.agenda_view = renderer(self.event_lbl_enter, self.event_lbl_leave)
+        self.widgets_container.pack_start(self.agenda_view, True, True, 0)
 
-        # Create timers to update clock and calendar at fixed time intervals
-        GLib.timeout_add(1000, self.update_clock)
-        GLib.timeout_add(1000, self.update_agenda)
-        GLib.timeout_add(1000, self.reminders)
+        # Only build the rows that fit on screen, again whenever the monitors or font sizes change
+        screen.connect("monitors-changed", self.on_layout_changed)
+        screen.connect("size-changed", self.on_layout_changed)
+        self.agenda_view.connect("style-updated", self.on_style_updated)
+
+        # Update clock at startup and show the stored agenda before syncing with the API
+        self.update_clock()
+        self.update_viewport()
+        self.on_events_loaded(self.calendar.load_cached_events(days=self.prefs_window.get_query_days(),
+                                                               max_results=self.prefs_window.get_query_limit()))
+        self.update_agenda()
+
+        # Update the clock at wall-clock aligned intervals, the agenda is synced as the refresh policy decides
+        self.timers = WallClockTimers()
+        self.timers.add("clock", 60, self.update_clock)
+        # Between syncs, which can be an hour apart, drop the events that ended and the past date headers.
+        # Only the rows that changed are touched, see render_agenda()
+        self.timers.add("agenda", 60, self.render_agenda)
+        self.timers.on_resume(self.reminder_scheduler.rearm)
+        self.timers.on_resume(self.on_resume)
+
+        # Answer status bar and script queries from the loaded events
+        self.query_service = query_service
+        if self.query_service is not None:
+            self.query_service.start(self.calendar)
+
+        # Apply preferences edited in the preferences window or in the file itself
+        self.prefs_window.watch(self.apply_preferences)
 
     def position(self):
-        # Right side of displays
+        # Left or right side of displays, as set by the screen position preference
+        if self.prefs_window.get_screen_position() == "left":
+            self.move(0, 0)
+            return
         display = Gdk.Display.get_default()
         display_width = 0
         for i in range(display.get_n_monitors()):
@@ -129,141 +198,63 @@ class MainWindow(Gtk.Window):
         window_size = self.get_size()
         self.move(display_width - window_size.width, 0)
 
+    def update_viewport(self):
+        """
+        Limit the agenda to the height of the monitor the window is placed on (see position()) below the clock.
+        """
+        display = Gdk.Display.get_default()
+        monitors = [display.get_monitor(i) for i in range(display.get_n_monitors())]
+        if not monitors:
+            return
+        if self.prefs_window.get_screen_position() == "left":
+            monitor = min(monitors, key=lambda m: m.get_geometry().x)
+        else:
+            monitor = max(monitors, key=lambda m: m.get_geometry().x + m.get_geometry().width)
+        clock_height = self.clock_container.get_preferred_height()[1]
+        self.agenda_view.set_max_height(monitor.get_workarea().height - clock_height)
+
+    def on_layout_changed(self, screen):
+        self.update_viewport()
+        self.render_agenda()
+        self.position()
+
+    def on_style_updated(self, widget):
+        self.agenda_view.clear_heights()
+        self.update_viewport()
+        self.render_agenda()
+
     def date_handler(self, date):
         """
-        This date handler creates a new label containing the specified date.
+        This date handler places a header containing the specified date in the agenda view.
+        It returns False once the header and one event would extend past the bottom of the screen.
         This function may return False to cancel further processing of events.
         Return True to allow processing of events to continue.
         """
-        dt = parse(date)
-
         # Do not create a date label because current date label already exists
-        if dt.date() == datetime.today().date():
+        if date == datetime.today().date():
             return True
 
-        # TODO: If creating a date label and one event label would exceed bottom of
-        # screen, set a flag indicating this and return False to prevent further
-        # processing. The challenge is in keeping track of where the last label was
-        # placed relative to the height of the screen.
-        # if self.screenMaxReached:
-        #     return
-
-        lbl = Gtk.Label(label=dt.strftime(CLOCK_DATE_FORMAT), xalign=0)
-        lbl.get_style_context().add_class("lbl")
-        lbl.get_style_context().add_class("date-header-lbl")
-        self.event_container.attach(lbl, 0, self.row, 2, 1)
-        self.row += 1
-
-        return True
+        return self.agenda_view.add_date(date)
 
     def event_handler(self, event):
         """
-        This event handler creates labels for a calendar event.
-        The label will be created with mouse-over tooltip containing the
+        This event handler places the row of a calendar event in the agenda view.
+        The row is created with mouse-over tooltip containing the
         location and name of the meeting organizer.
         A click handler is also created to open the event in a web browser.
+        It returns False once the row would extend past the bottom of the screen.
         This function may return False to cancel further processing of events.
         Return True to allow processing of events to continue.
         """
         # Useful event fields:
-        # event["status"]   - "confirmed"
-        # event["htmlLink"] - "https://www.google.com/calendar/event?eid=xxxxxxxx"
-        # event["summary"]  - "Status Meeting"
-        # event["start"]    - {dateTime: 2019-03-21T10:00:00-07:00}
-        # TODO: event["datetime"] - event["start"] parsed into a Python DateTime object
-        # event["location"] - "Conference Room"
-        # event["organizer"] - {email : email@corp.com}
-        # event["creator"] - {email : email@corp.com}
-
-        # TODO: If creating an event label would exceed bottom of screen, set a
-        # flag indicating this and return
-        # if self.screenMaxReached:
-        #     return
-
-        title = event.get("summary", "(No title)")
-        ev_time = ""
-        location = event.get("location", "(No location)")
-        organizer = event.get("organizer", event.get("creator", None))
-        if organizer is not None:
-            organizer = organizer.get("displayName", organizer.get("email", None))
-
-        html_link = event.get("htmlLink", None)
-
-        date = event["start"].get("dateTime", None)
-        if date is not None:
-            dt = parse(date)
-            ev_time = dt.strftime(TIME_LBL_FORMAT)
-
-        time_lbl = Gtk.Label(xalign=0)
-        time_lbl.set_halign(Gtk.Align.END)
-        lbl_color = event.get("color", None)
-        # print(lbl_color)
-        if lbl_color is not None:
-            time_lbl.set_markup("<span foreground='{}'>{}</span>".format(event["color"], ev_time))
-        time_lbl.get_style_context().add_class("lbl")
-        time_lbl.get_style_context().add_class("event-time-lbl")
-        self.event_container.attach(time_lbl, 0, self.row, 1, 1)
-
-        title_lbl = Gtk.Label(label=title, xalign=0)
-        title = title.replace("&", "&amp;")
-        if lbl_color is not None:
-            title_lbl.set_markup("<span foreground='{}'>{}</span>".format(event["color"], title))
-
-        # Set tooltip
-        tooltip_text = "Location: {}".format(location)
-        if organizer is not None:
-            tooltip_text = "{}\nOrganizer: {}".format(tooltip_text, organizer)
-        title_lbl.set_tooltip_text(tooltip_text)
-
-        # Set label style
-        title_lbl.get_style_context().add_class("lbl")
-        title_lbl.get_style_context().add_class("event-title-lbl")
-
-        # Create a click event handler to open the event in a web browser
-        # This handler is unique to this label so it is defined as an inner function
-        def lbl_click_handler(widget, event):
-            Gtk.show_uri(None, html_link, time.time())
-
-        # Create a container that will handle user interaction
-        event_box = Gtk.EventBox()
-        event_box.connect("button-press-event", lbl_click_handler)
-        # The mouse enter and leave events need to pass through to the main window
-        event_box.connect("enter-notify-event", self.event_lbl_enter)
-        event_box.connect("leave-notify-event", self.event_lbl_leave)
-        event_box.add(title_lbl)
-
-        # Add the new label to the window layout
-        self.event_container.attach(event_box, 1, self.row, 1, 1)
-        self.row += 1
-
-        return True
-
-    def _reminder_handler(self, event):
-        """
-        Checks if the given event has a notification that needs to be shown and
-        creates a taskbar notification if necessary.
-        This function may return False to cancel further processing of events.
-        Return True to allow processing of events to continue.
-        """
-        date = event["start"].get("dateTime", None)
-        if date is None:
-            return True
-        dt = parse(date).astimezone(pytz.utc)
-        now = datetime.now(pytz.utc).replace(second=0, microsecond=0)
+        # event.html_link - "https://www.google.com/calendar/event?eid=xxxxxxxx"
+        # event.summary   - "Status Meeting"
+        # event.start     - datetime(2019, 3, 21, 10, 0, tzinfo=tzlocal())
+        # event.all_day   - False
+        # event.location  - "Conference Room" or None
+        # event.organizer - "email@corp.com" or None
 
-        for reminder in event["reminders"]:
-            method = reminder.get("method", None)
-            if method is None or method != "popup":
-                continue
-            minutes = reminder.get("minutes", 0)
-            if minutes <= 0:
-                continue
-            reminder_time = dt - timedelta(minutes=minutes)
-            if reminder_time == now:
-                # TODO: Create popup notification
-                #print "popup"
-                return False  # Only create one popup and cancel further event handlers
-        return True
+        return self.agenda_view.add_event(event)
 
     def event_lbl_enter(self, widget, event):
         pointer = Gdk.Cursor(Gdk.CursorType.HAND1)  # TODO: should pointer be a class variable?
@@ -281,9 +272,6 @@ class MainWindow(Gtk.Window):
         return False
 
     def update_clock(self):
-        # TODO: Attempted to decouple clock label updates from agenda updates.
-        # If API is unreachable because there is no internet connection,
-        # the clock labels stop updating. This is unconfirmed hypothesis
         now = datetime.now()
         now_utc = datetime.now(pytz.utc)
 
@@ -293,44 +281,188 @@ class MainWindow(Gtk.Window):
         self.time_lbl.set_text(time_str)
         self.time_lbl.set_tooltip_text(time_utc_str)
         self.date_lbl.set_text(date_str)
+        self.date_lbl.set_tooltip_text(self.now_and_next(now.timestamp()))
 
-        return True
+    def now_and_next(self, timestamp):
+        """
+        Summaries of the events in progress and of the next event, from the event index
+        """
+        index = self.calendar.index
+        lines = ["Now: " + event.summary for event in index.at(timestamp) if not event.all_day]
+        upcoming = next((event for event in index.starting_after(timestamp) if not event.all_day), None)
+        if upcoming is not None:
+            lines.append("Next: {} at {}".format(upcoming.summary, upcoming.start.strftime(CLOCK_TIME_FORMAT)))
+        return "\n".join(lines) if lines else None
+
+    def update_agenda(self):
+        """
+        Request a sync of the agenda with the API.
+        The agenda window is updated by on_events_loaded() when the sync completes.
+        """
+        self.sync_worker.request(days=self.prefs_window.get_query_days(),
+                                 max_results=self.prefs_window.get_query_limit())
+        # Keep refreshing at the current interval even if this sync never completes
+        self.schedule_refresh(self.refresh_policy.interval)
 
-    def update_agenda(self, force=False):
+    def on_resume(self):
         """
-        Updates the entire adenda window
-        This function should return True so the timer will continue to run.
-        Returning False will cancel the timer.
+        Sync right away after a suspend, also with the providers that failed while the network was going down
         """
-        now = datetime.now()
+        self.calendar.reset_backoff()
+        self.render_agenda()
+        self.update_agenda()
 
-        # TODO: Use a timeout for API requests in google_calendar.py
+    def schedule_refresh(self, interval):
+        if self.refresh_timer is not None:
+            GLib.source_remove(self.refresh_timer)
+        self.refresh_timer = GLib.timeout_add_seconds(int(interval), self.on_refresh_timer)
 
-        if (now.second == 0 and now.minute % 15 == 0) or force:
+    def on_refresh_timer(self):
+        self.refresh_timer = None
+        self.update_agenda()
+        return False  # One-shot timeout, update_agenda() schedules the next one
 
-            # Synchronous API query
-            self.calendar.load_events(days=self.prefs_window.get_query_days(),
-                                      max_results=self.prefs_window.get_query_limit())
+    def on_events_synced(self, events):
+        """
+        Called on the main loop by the sync worker when a fetch completes.
+        """
+        if not self.first_sync_done:
+            self.first_sync_done = True
+            elapsed = time.monotonic() - STARTUP_TIME
+            self.metrics.observe("startup_live_agenda", elapsed)
+            print(f"Time to live agenda: {elapsed * 1000:.0f} ms")
+        self.on_events_loaded(events)
+        self.snapshot_writer.submit(save_snapshot, events)
+        if self.query_service is not None:
+            self.query_service.publish()
+        self.authorize_accounts()
+
+        self.refresh_policy.record_sync(self.calendar.last_sync[0])
+        interval = self.refresh_policy.next_interval(self.calendar.index, self.calendar.retry_delay())
+        self.schedule_refresh(interval)
+        self.metrics.observe("refresh_interval", interval)
+        print(f"Next agenda refresh in {interval / 60:.1f} min ({self.refresh_policy.reason})")
+        self.metrics.export()
+
+    def authorize_accounts(self, event=None):
+        """
+        Open the browser for the Google accounts whose last sync needs authorization.
+        After a sync, only the accounts that were never asked are; from the menu, all of them.
+        Each consent waits on a thread of its own, so the other accounts go on syncing meanwhile.
+        """
+        for provider in self.calendar.providers:
+            if not isinstance(provider, GoogleCalendar) or not provider.needs_authorization() \
+                    or provider in self.authorizing or (event is None and provider in self.authorize_prompted):
+                continue
+            self.authorizing.add(provider)
+            self.authorize_prompted.add(provider)
+            threading.Thread(target=self.authorize, args=(provider,), name="authorize", daemon=True).start()
+
+    def authorize(self, provider):
+        try:
+            provider.authorize()
+            authorized = True
+        except Exception as err:
+            print(f"Failed to authorize {provider.name}: {err}")
+            authorized = False
+        GLib.idle_add(self.on_authorized, provider, authorized)
+
+    def on_authorized(self, provider, authorized):
+        self.authorizing.discard(provider)
+        if authorized:
+            self.calendar.reset_backoff(provider)
+            self.update_agenda()
+        return False  # Run once
+
+    def on_events_loaded(self, events):
+        """
+        Show the given events, either synced with the API or read from the local event store.
+        """
+        self.loaded = EventIndex(events)
+        self.loaded_days = self.prefs_window.get_query_days()
+        self.loaded_limit = self.prefs_window.get_query_limit()
+        self.show_loaded_events()
 
-            # Remove all event labels
-            if self.event_container is not None:
-                self.event_container.destroy()
-                self.row = 0
+    def show_loaded_events(self):
+        """
+        Show the loaded events that are within the current preferences
+        """
+        now = time.time()
+        days = self.prefs_window.get_query_days()
+        events = self.loaded.limited(now, now + days * 24 * 60 * 60, self.prefs_window.get_query_limit())
+        self.calendar.set_events(events)
+        self.calendar_styles.update(self.calendar.get_palette(), self.prefs_window.get_style_calendar_colors())
+        self.reminder_scheduler.set_events(self.calendar.index)
+        self.render_agenda()
+        self.update_clock()
 
-            # Create new labels
-            self.event_container = Gtk.Grid()
-            self.widgets_container.pack_start(self.event_container, True, True, 0)
+    def render_agenda(self):
+        """
+        Update the event labels from the events already loaded in memory.
+        Only the rows of events that changed since the last update are touched.
+        """
+        with self.metrics.phase("render"):
+            self.agenda_view.begin()
+            self.calendar.get_events(self.date_handler, self.event_handler, since=time.time())
+            self.agenda_view.finish()
 
-            self.calendar.get_events(self.date_handler, self.event_handler)
-            self.show_all()
+    def get_applied_prefs(self):
+        return (self.prefs_window.get_query_days(), self.prefs_window.get_query_limit(),
+                self.prefs_window.get_style_calendar_colors(), self.prefs_window.get_screen_position(),
+                self.prefs_window.get_ics_files(), self.prefs_window.get_accounts())
 
-        return True
+    def create_providers(self, providers=()):
+        """
+        Return the providers of the configured Google accounts and calendar files,
+        reusing those in `providers` that are still configured
+        """
+        accounts = {provider.account: provider for provider in providers if isinstance(provider, GoogleCalendar)}
+        files = {provider.path: provider for provider in providers if isinstance(provider, IcsCalendar)}
+        # The default account keeps its token and event store directly in ~/.dags
+        return ([accounts.get(account) or GoogleCalendar(metrics=self.metrics, account=account)
+                 for account in [None] + self.prefs_window.get_accounts()] +
+                [files.get(os.path.expanduser(path)) or IcsCalendar(path)
+                 for path in self.prefs_window.get_ics_files()])
+
+    def apply_preferences(self):
+        """
+        Update the agenda after the preferences changed.
+        A narrower window or a lower limit is served from the loaded events and a color style
+        change only re-renders them, without any API calls. A higher limit is read from the local
+        event store, and only a wider window is fetched, which syncs just the additional range.
+        """
+        applied_prefs = self.get_applied_prefs()
+        if applied_prefs == self.applied_prefs:
+            return  # e.g. the file was saved without changes
+        days, limit, calendar_colors, screen_position = applied_prefs[:4]
+        if screen_position != self.applied_prefs[3]:
+            self.update_viewport()  # The events are rendered again below
+            self.position()
+        self.applied_prefs = applied_prefs
+        print(f"Applying preferences: days={days} limit={limit} calendar_colors={calendar_colors}")
+
+        self.calendar_styles.update(self.calendar.get_palette(), calendar_colors)
+        widened = days > self.loaded_days
+        providers = self.create_providers(self.calendar.providers)
+        if providers != self.calendar.providers:
+            self.authorize_prompted.difference_update(set(self.calendar.providers) - set(providers))
+            self.calendar.set_providers(providers)
+            widened = True  # Added accounts and files have not been fetched yet
+
+        if widened:
+            self.on_events_loaded(self.calendar.load_cached_events(days=days, max_results=limit))
+            self.update_agenda()
+        elif limit > self.loaded_limit:
+            self.on_events_loaded(self.calendar.load_cached_events(days=days, max_results=limit))
+        else:
+            self.show_loaded_events()
 
-    def reminders(self):
-        now = datetime.now()
-        if now.second == 0:
-            self.calendar.get_events(None, self._reminder_handler)
-        return True
+    def on_first_paint(self, widget, cr):
+        self.disconnect(self.first_paint_handler)
+        elapsed = time.monotonic() - STARTUP_TIME
+        self.metrics.observe("startup_first_paint", elapsed)
+        print(f"Time to first paint: {elapsed * 1000:.0f} ms")
+        return False
 
     def enter_notify(self, event, data):
         self.set_keep_below(False)
@@ -357,7 +489,9 @@ class MainWindow(Gtk.Window):
             event.set_label("Hide")
 
     def refresh_agenda(self, event):
-        self.update_agenda(force=True)
+        self.calendar.invalidate_metadata()
+        self.calendar.reset_backoff()
+        self.update_agenda()
 
     def show_prefs(self, event):
         """
@@ -367,12 +501,31 @@ class MainWindow(Gtk.Window):
         self.prefs_window.show_all()
         return
 
+    def show_metrics(self, event):
+        """
+        Menu handler to show the performance measurements.
+        """
+        dialog = Gtk.MessageDialog(message_type=Gtk.MessageType.INFO, buttons=Gtk.ButtonsType.CLOSE,
+                                   text="Desktop Agenda Performance")
+        dialog.format_secondary_text(self.metrics.summary())
+        dialog.run()
+        dialog.destroy()
+
     def quit(self, event):
+        self.sync_worker.stop()
+        if self.query_service is not None:
+            self.query_service.stop()
         Gtk.main_quit()
 
 
 if __name__ == "__main__":
-    window = MainWindow()
+    # Only one instance syncs, a second one finds the query socket of the first
+    query_service = QueryService()
+    if not query_service.bind():
+        print(f"Desktop Agenda is already running, query it on {query_service.path}")
+        sys.exit(1)
+
+    window = MainWindow(query_service)
     window.show_all()
     window.position()
 
@@ -0,0 +1,96 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime, time, timedelta
+from dateutil.tz import tzlocal
+
+
+class EventIndex:
+    """
+    Time-range index over a set of CalendarEvent records.
+    Events are kept sorted by start time along with parallel arrays of start and end
+    timestamps. Since no short event lasts longer than the longest one, every short event
+    overlapping a time t starts within max_duration before t, which bounds the range to bisect.
+    Events longer than LONG_EVENT, such as holidays or on-call shifts spanning weeks, are kept
+    in a separate list that is scanned whole, so they do not widen that range.
+    All-day and multi-day events are indexed by their full [start, end) span.
+    Range queries cost O(log n) plus the events inside the bounded range and the long events.
+    """
+
+    LONG_EVENT = 24 * 60 * 60  # Seconds, longer events are kept out of the bisected range
+
+    def __init__(self, events=()):
+        self.events = sorted(events, key=lambda event: event.start)  # Stable, keeps the order of equal starts
+        self._starts = [event.start.timestamp() for event in self.events]
+        self._ends = [event.end.timestamp() for event in self.events]
+        # Positions in self.events of the short and the long events, each in start order
+        self._short = [i for i in range(len(self.events)) if self._ends[i] - self._starts[i] <= self.LONG_EVENT]
+        self._long = [i for i in range(len(self.events)) if self._ends[i] - self._starts[i] > self.LONG_EVENT]
+        self._short_starts = [self._starts[i] for i in self._short]
+        self._max_duration = max((self._ends[i] - self._starts[i] for i in self._short), default=0)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def overlapping(self, t0, t1):
+        """
+        Events overlapping [t0, t1) in start order, timestamps in seconds since the epoch.
+        Instant (zero-length) events are included when they fall within the range.
+        """
+        first = bisect_left(self._short_starts, t0 - self._max_duration)
+        last = bisect_left(self._short_starts, t1, lo=first)
+        positions = [i for i in self._short[first:last] if self._ends[i] > t0 or self._starts[i] >= t0]
+        return self._merge_long(positions, lambda i: self._starts[i] < t1 and self._ends[i] > t0)
+
+    def limited(self, t0, t1, max_results):
+        """
+        Events overlapping [t0, t1) in start order, at most max_results per calendar
+        like the providers return them
+        """
+        counts = {}
+        events = []
+        for event in self.overlapping(t0, t1):
+            count = counts.get(event.calendar_id, 0)
+            if count < max_results:
+                counts[event.calendar_id] = count + 1
+                events.append(event)
+        return events
+
+    def at(self, t):
+        """
+        Events in progress at timestamp t
+        """
+        first = bisect_left(self._short_starts, t - self._max_duration)
+        last = bisect_right(self._short_starts, t, lo=first)
+        positions = [i for i in self._short[first:last] if self._ends[i] > t]
+        return self._merge_long(positions, lambda i: self._starts[i] <= t < self._ends[i])
+
+    def starting_after(self, t):
+        """
+        Iterator over the events starting after timestamp t, in start order
+        """
+        return (self.events[i] for i in range(bisect_right(self._starts, t), len(self.events)))
+
+    def next_after(self, t):
+        """
+        The first event starting after timestamp t, or None
+        """
+        i = bisect_right(self._starts, t)
+        return self.events[i] if i < len(self.events) else None
+
+    def on_date(self, date):
+        """
+        Events taking place on the given local date, including multi-day events spanning it
+        """
+        midnight = datetime.combine(date, time.min, tzinfo=tzlocal())
+        return self.overlapping(midnight.timestamp(), (midnight + timedelta(days=1)).timestamp())
+
+    def _merge_long(self, positions, matches):
+        """
+        Events at the given positions of short events and the long events that match, in start order
+        """
+        long_positions = [i for i in self._long if matches(i)]
+        if long_positions:
+            positions = sorted(positions + long_positions)
+        return [self.events[i] for i in positions]
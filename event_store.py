@@ -0,0 +1,172 @@
+from calendar_event import CalendarEvent
+import json
+import sqlite3
+import threading
+
+
+class EventStore:
+    """
+    Persistent on-disk store of synced calendar events, backed by SQLite.
+    Each calendar row keeps the nextSyncToken of its last sync and the time range
+    covered by its last full sync, so later syncs only need to request deltas.
+    The store is safe to use from the sync worker threads.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS calendars (
+            id TEXT PRIMARY KEY,
+            selected INTEGER NOT NULL DEFAULT 1,
+            color TEXT,
+            name TEXT,
+            rank INTEGER NOT NULL DEFAULT 3,
+            reminders TEXT NOT NULL DEFAULT '[]',
+            sync_token TEXT,
+            synced_from REAL,
+            synced_until REAL
+        );
+        CREATE TABLE IF NOT EXISTS events (
+            calendar_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            start_ts REAL NOT NULL,
+            end_ts REAL NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (calendar_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS events_by_start ON events (calendar_id, start_ts);
+    """
+    # Columns added to the calendars table after its creation, for stores created before them
+    CALENDAR_COLUMNS = {"name": "name TEXT", "rank": "rank INTEGER NOT NULL DEFAULT 3"}
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(self.SCHEMA)
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(calendars)")}
+            for column, definition in self.CALENDAR_COLUMNS.items():
+                if column not in columns:
+                    self._db.execute("ALTER TABLE calendars ADD COLUMN " + definition)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def get_sync_state(self, calendar_id):
+        """
+        Return (sync_token, synced_from, synced_until) for a calendar, or None if it was never synced
+        """
+        with self._lock:
+            row = self._db.execute("SELECT sync_token, synced_from, synced_until FROM calendars WHERE id = ?",
+                                   (calendar_id,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return row
+
+    def set_calendars(self, calendars, colors, ranks):
+        """
+        Record the calendar list returned by the API so the agenda can be shown while offline.
+        `colors` maps calendar ids to their display color and `ranks` to the rank of their events
+        (see CalendarEvent).
+        """
+        with self._lock, self._db:
+            self._db.execute("UPDATE calendars SET selected = 0")
+            for cal in calendars:
+                self._db.execute("INSERT INTO calendars (id, selected, color, name, rank) VALUES (?, ?, ?, ?, ?) "
+                                 "ON CONFLICT (id) DO UPDATE SET selected = excluded.selected, "
+                                 "color = excluded.color, name = excluded.name, rank = excluded.rank",
+                                 (cal["id"], 1 if cal.get("selected", False) else 0, colors.get(cal["id"]),
+                                  cal.get("summaryOverride", cal.get("summary", cal["id"])), ranks[cal["id"]]))
+
+    def get_selected_calendars(self):
+        with self._lock:
+            rows = self._db.execute("SELECT id FROM calendars WHERE selected = 1").fetchall()
+        return [row[0] for row in rows]
+
+    def begin_full_sync(self, calendar_id, events):
+        """
+        Replace everything known about the calendar with the first page of a full sync.
+        The calendar has no sync token until finish_full_sync() is called.
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM events WHERE calendar_id = ?", (calendar_id,))
+            self._db.execute("UPDATE calendars SET sync_token = NULL WHERE id = ?", (calendar_id,))
+            self._upsert(calendar_id, events)
+
+    def add_events(self, calendar_id, events):
+        """
+        Store a later page of a full sync
+        """
+        with self._lock, self._db:
+            self._upsert(calendar_id, events)
+
+    def finish_full_sync(self, calendar_id, reminders, sync_token, synced_from, synced_until):
+        with self._lock, self._db:
+            self._db.execute("UPDATE calendars SET reminders = ?, sync_token = ?, synced_from = ?, synced_until = ? "
+                             "WHERE id = ?",
+                             (json.dumps(reminders), sync_token, synced_from, synced_until, calendar_id))
+
+    def extend_window(self, calendar_id, events, synced_until):
+        """
+        Store the events of the range listed beyond the previous synced_until of the calendar
+        """
+        with self._lock, self._db:
+            self._upsert(calendar_id, events)
+            self._db.execute("UPDATE calendars SET synced_until = ? WHERE id = ?", (synced_until, calendar_id))
+
+    def apply_changes(self, calendar_id, events, reminders, sync_token):
+        """
+        Store the result of an incremental sync.
+        Cancelled events are removed, all others are inserted or updated.
+        """
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM events WHERE calendar_id = ? AND id = ?",
+                                 [(calendar_id, event["id"]) for event in events if event.get("status") == "cancelled"])
+            self._upsert(calendar_id, [event for event in events if event.get("status") != "cancelled"])
+            self._db.execute("UPDATE calendars SET reminders = ?, sync_token = ? WHERE id = ?",
+                             (json.dumps(reminders), sync_token, calendar_id))
+
+    def reset_calendar(self, calendar_id):
+        """
+        Forget the sync token of a calendar so the next sync is a full sync
+        """
+        with self._lock, self._db:
+            self._db.execute("UPDATE calendars SET sync_token = NULL WHERE id = ?", (calendar_id,))
+
+    def prune(self, end_before):
+        """
+        Remove events that ended before the given timestamp
+        """
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM events WHERE end_ts <= ?", (end_before,))
+
+    def query(self, calendar_ids, start_ts, end_ts, max_results):
+        """
+        Return the events of each calendar overlapping [start_ts, end_ts), limited to max_results
+        per calendar, as CalendarEvent records with the calendar color, default reminders, name and rank.
+        The result holds one list of events per calendar, each ordered by start time.
+        """
+        streams = []
+        with self._lock:
+            for calendar_id in calendar_ids:
+                cal = self._db.execute("SELECT color, reminders, name, rank FROM calendars WHERE id = ?",
+                                       (calendar_id,)).fetchone()
+                if cal is None:
+                    continue
+                color, reminders, name, rank = cal[0], json.loads(cal[1]), cal[2], cal[3]
+                rows = self._db.execute("SELECT data, start_ts, end_ts FROM events "
+                                        "WHERE calendar_id = ? AND start_ts < ? AND end_ts > ? "
+                                        "ORDER BY start_ts LIMIT ?",
+                                        (calendar_id, end_ts, start_ts, max_results)).fetchall()
+                streams.append([CalendarEvent.from_api(json.loads(row[0]), calendar_id, color, reminders,
+                                                       start_ts=row[1], end_ts=row[2], calendar_name=name, rank=rank)
+                                 for row in rows])
+        return streams
+
+    def _upsert(self, calendar_id, events):
+        rows = []
+        for event in events:
+            start, _ = CalendarEvent.parse_time(event["start"])
+            end, _ = CalendarEvent.parse_time(event.get("end", event["start"]))
+            rows.append((calendar_id, event["id"], start.timestamp(), end.timestamp(), json.dumps(event)))
+        self._db.executemany("INSERT OR REPLACE INTO events (calendar_id, id, start_ts, end_ts, data) "
+                             "VALUES (?, ?, ?, ?, ?)", rows)
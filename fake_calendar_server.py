@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+
+"""
+Local stand-in for the parts of the Google Calendar API v3 used by the Desktop Agenda application:
+calendarList.list, events.list (with pagination and sync tokens) and colors.get.
+Responses only hold the fields of the real resources, reduced to the `fields` partial
+response mask, and a mask selecting a field the resource does not have is rejected with
+400 Bad Request like the real API does.
+It synthesizes N calendars of M events each and can add latency and inject errors,
+so the agenda can be measured without touching the real API (see benchmark.py).
+
+Run it on its own with:
+python fake_calendar_server.py --calendars 10 --events 100
+and point GoogleCalendar(api_endpoint=...) at the printed URL.
+"""
+
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+import argparse
+import gzip
+import json
+import random
+import re
+import threading
+import time
+
+# Fields of the API resources, as in the discovery document. A nested dict lists the fields of
+# a sub-resource, None marks a field whose sub-fields are not checked.
+EVENT_SCHEMA = dict.fromkeys([
+    "kind", "etag", "id", "status", "htmlLink", "created", "updated", "summary", "description", "location",
+    "colorId", "creator", "organizer", "start", "end", "endTimeUnspecified", "recurrence", "recurringEventId",
+    "originalStartTime", "transparency", "visibility", "iCalUID", "sequence", "attendees", "attendeesOmitted",
+    "extendedProperties", "hangoutLink", "conferenceData", "gadget", "anyoneCanAddSelf", "guestsCanInviteOthers",
+    "guestsCanModify", "guestsCanSeeOtherGuests", "privateCopy", "locked", "reminders", "source", "attachments",
+    "eventType", "workingLocationProperties", "outOfOfficeProperties", "focusTimeProperties"])
+EVENTS_SCHEMA = dict.fromkeys(["kind", "etag", "summary", "description", "updated", "timeZone", "accessRole",
+                               "defaultReminders", "nextPageToken", "nextSyncToken"], None)
+EVENTS_SCHEMA["items"] = EVENT_SCHEMA
+CALENDAR_LIST_ENTRY_SCHEMA = dict.fromkeys([
+    "kind", "etag", "id", "summary", "description", "location", "timeZone", "summaryOverride", "colorId",
+    "backgroundColor", "foregroundColor", "hidden", "selected", "accessRole", "defaultReminders",
+    "notificationSettings", "primary", "deleted", "conferenceProperties"])
+CALENDAR_LIST_SCHEMA = {"kind": None, "etag": None, "nextPageToken": None, "nextSyncToken": None,
+                        "items": CALENDAR_LIST_ENTRY_SCHEMA}
+COLORS_SCHEMA = dict.fromkeys(["kind", "updated", "calendar", "event"])
+
+COLOR_PALETTE = ["#ac725e", "#d06b64", "#f83a22", "#fa573c", "#ff7537", "#ffad46", "#42d692", "#16a765",
+                 "#7bd148", "#b3dc6c", "#fbe983", "#fad165", "#92e1c0", "#9fe1e7", "#9fc6e7", "#4986e7"]
+
+
+class FakeCalendarData:
+    """
+    Synthetic calendars and events.
+    Every event carries the version at which it last changed; a sync token is the
+    version at which it was issued, so a sync returns the events changed since then.
+    """
+
+    def __init__(self, calendars=10, events=100, days=30, seed=0):
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.version = 1
+        self.min_sync_version = 0  # Sync tokens issued before this version are rejected with 410 Gone
+        self.calendars = []
+        self.events = {}  # calendar id -> list of events ordered by start time
+
+        start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        spacing = timedelta(days=days) / max(events, 1)
+        for c in range(calendars):
+            calendar_id = f"calendar-{c}@fake.example.com"
+            self.calendars.append({"kind": "calendar#calendarListEntry", "id": calendar_id,
+                                   "summary": f"Calendar {c}", "colorId": str(c % len(COLOR_PALETTE) + 1),
+                                   "selected": True, "accessRole": "owner" if c == 0 else "reader",
+                                   "primary": c == 0})
+            self.events[calendar_id] = [self._make_event(c, i, start + spacing * i) for i in range(events)]
+
+    def _make_event(self, c, i, start):
+        end = start + timedelta(minutes=self._random.choice([15, 30, 60, 90]))
+        event = {"kind": "calendar#event", "id": f"c{c}e{i}", "iCalUID": f"c{c}e{i}@fake.example.com",
+                 "status": "confirmed", "htmlLink": f"https://calendar.example.com/event?eid=c{c}e{i}",
+                 "summary": f"Event {i} of calendar {c}", "updated": start.isoformat(),
+                 "start": {"dateTime": start.isoformat()}, "end": {"dateTime": end.isoformat()},
+                 "organizer": {"email": f"organizer{c}@fake.example.com"},
+                 "reminders": {"useDefault": True},
+                 "description": "x" * self._random.randint(0, 500),
+                 "attendees": [{"email": f"attendee{a}@fake.example.com"} for a in range(self._random.randint(0, 10))],
+                 "_version": self.version}
+        if i % 3 == 0:
+            event["location"] = f"Room {i % 17}"
+        if i % 11 == 0:
+            day = start.date()
+            event["start"] = {"date": day.isoformat()}
+            event["end"] = {"date": (day + timedelta(days=1)).isoformat()}
+        return event
+
+    def touch(self, count=1, cancel=False):
+        """
+        Update (or cancel) `count` random events, as another client editing the calendars would
+        """
+        with self._lock:
+            self.version += 1
+            for _ in range(count):
+                events = self.events[self._random.choice(self.calendars)["id"]]
+                event = self._random.choice(events)
+                event["summary"] = f"{event['summary']} (edited)"
+                event["updated"] = datetime.now(timezone.utc).isoformat()
+                if cancel:
+                    event["status"] = "cancelled"
+                event["_version"] = self.version
+
+    def expire_sync_tokens(self):
+        with self._lock:
+            self.min_sync_version = self.version + 1
+            self.version += 1
+
+    def list_events(self, calendar_id, params):
+        """
+        Return (status, body) of an events.list request
+        """
+        with self._lock:
+            events = self.events.get(calendar_id, None)
+            if events is None:
+                return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+            sync_token = params.get("syncToken", None)
+            if sync_token is not None:
+                since = int(sync_token)
+                if since < self.min_sync_version:
+                    return 410, {"error": {"code": 410, "message": "Sync token is no longer valid"}}
+                matches = [event for event in events if event["_version"] > since]
+            else:
+                time_min = _parse_time(params.get("timeMin", None))
+                time_max = _parse_time(params.get("timeMax", None))
+                matches = [event for event in events if event["status"] != "cancelled"
+                           and (time_max is None or _event_time(event["start"]) < time_max)
+                           and (time_min is None or _event_time(event["end"]) > time_min)]
+            version = self.version
+
+        max_results = min(int(params.get("maxResults", 250)), 2500)
+        offset = int(params.get("pageToken", 0))
+        page = matches[offset:offset + max_results]
+        body = {"kind": "calendar#events", "etag": f"\"{version}\"",
+                "defaultReminders": [{"method": "popup", "minutes": 10}],
+                "items": [{k: v for k, v in event.items() if not k.startswith("_")} for event in page]}
+        if offset + max_results < len(matches):
+            body["nextPageToken"] = str(offset + max_results)
+        else:
+            body["nextSyncToken"] = str(version)
+        return 200, body
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _event_time(field):
+    if "dateTime" in field:
+        return datetime.fromisoformat(field["dateTime"])
+    return datetime.fromisoformat(field["date"]).replace(tzinfo=timezone.utc)
+
+
+class FakeCalendarServer(ThreadingHTTPServer):
+    """
+    HTTP server answering Calendar API v3 requests from FakeCalendarData.
+    `latency` seconds are added to every response and `error_rate` is the probability
+    of answering a request with 503 Service Unavailable.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, data, latency=0.0, error_rate=0.0, host="127.0.0.1", port=0):
+        ThreadingHTTPServer.__init__(self, (host, port), _FakeCalendarHandler)
+        self.data = data
+        self.latency = latency
+        self.error_rate = error_rate
+        self.request_count = 0
+        self.bytes_sent = 0
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        API endpoint to pass to GoogleCalendar(api_endpoint=...)
+        """
+        return "http://{}:{}/calendar/v3/".format(*self.server_address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-calendar-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def parse_fields(mask):
+    """
+    Parse a partial response mask such as "etag,items(id,start/dateTime)" into a nested dict
+    mapping each selected field to the selection of its sub-fields, or None for the whole field.
+    Raises ValueError for a malformed mask.
+    """
+    pos = 0
+
+    def read_name():
+        nonlocal pos
+        start = pos
+        while pos < len(mask) and mask[pos] not in ",()/":
+            pos += 1
+        name = mask[start:pos].strip()
+        if not name:
+            raise ValueError(f"Invalid field selection {mask}")
+        return name
+
+    def parse_list():
+        nonlocal pos
+        selection = {}
+        while True:
+            path = [read_name()]
+            while pos < len(mask) and mask[pos] == "/":
+                pos += 1
+                path.append(read_name())
+            sub = None
+            if pos < len(mask) and mask[pos] == "(":
+                pos += 1
+                sub = parse_list()
+                if pos >= len(mask) or mask[pos] != ")":
+                    raise ValueError(f"Invalid field selection {mask}")
+                pos += 1
+            target = selection
+            for name in path[:-1]:
+                if name in target and target[name] is None:
+                    break  # The whole field is already selected
+                target = target.setdefault(name, {})
+            else:
+                name = path[-1]
+                if name not in target:
+                    target[name] = sub
+                elif target[name] is None or sub is None:
+                    target[name] = None
+                else:
+                    target[name].update(sub)
+            if pos < len(mask) and mask[pos] == ",":
+                pos += 1
+                continue
+            return selection
+
+    selection = parse_list()
+    if pos != len(mask):
+        raise ValueError(f"Invalid field selection {mask}")
+    return selection
+
+
+def check_fields(selection, schema, prefix=""):
+    """
+    Return the first selected field that the schema does not have, or None
+    """
+    for name, sub in selection.items():
+        if name not in schema:
+            return prefix + name
+        if sub is not None and schema[name] is not None:
+            invalid = check_fields(sub, schema[name], prefix + name + "/")
+            if invalid is not None:
+                return invalid
+    return None
+
+
+def select_fields(body, selection):
+    """
+    The parts of a response body selected by a parsed mask
+    """
+    if isinstance(body, list):
+        return [select_fields(item, selection) for item in body]
+    if not isinstance(body, dict):
+        return body
+    return {name: body[name] if sub is None else select_fields(body[name], sub)
+            for name, sub in selection.items() if name in body}
+
+
+class _FakeCalendarHandler(BaseHTTPRequestHandler):
+
+    EVENTS_PATH = re.compile(r"^/calendar/v3/calendars/([^/]+)/events$")
+
+    def do_GET(self):
+        server = self.server
+        server.request_count += 1
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if server.error_rate > 0 and random.random() < server.error_rate:
+            return self._reply(503, {"error": {"code": 503, "message": "Injected error"}})
+
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == "/calendar/v3/users/me/calendarList":
+            self._reply_cacheable(params, CALENDAR_LIST_SCHEMA,
+                                  {"kind": "calendar#calendarList", "items": server.data.calendars})
+        elif url.path == "/calendar/v3/colors":
+            # The Colors resource has no etag, it is always sent in full
+            calendar_colors = {str(i + 1): {"background": color, "foreground": "#1d1d1d"}
+                               for i, color in enumerate(COLOR_PALETTE)}
+            self._reply_selected(params, COLORS_SCHEMA, 200, {"kind": "calendar#colors",
+                                                              "updated": "2012-02-14T00:00:00.000Z",
+                                                              "calendar": calendar_colors, "event": {}})
+        else:
+            match = self.EVENTS_PATH.match(url.path)
+            if match is None:
+                return self._reply(404, {"error": {"code": 404, "message": "Not Found"}})
+            self._reply_selected(params, EVENTS_SCHEMA, *server.data.list_events(unquote(match.group(1)), params))
+
+    def _reply_cacheable(self, params, schema, body):
+        etag = "\"{:x}\"".format(hash(json.dumps(body, sort_keys=True)) & 0xffffffff)
+        if self.headers.get("If-None-Match", None) == etag:
+            return self._reply(304, None)
+        body["etag"] = etag
+        self._reply_selected(params, schema, 200, body)
+
+    def _reply_selected(self, params, schema, status, body):
+        """
+        Reply with the fields selected by the `fields` parameter, rejecting fields the resource
+        does not have like the real API does
+        """
+        mask = params.get("fields", None)
+        if mask is not None and status == 200:
+            try:
+                selection = parse_fields(mask)
+                invalid = check_fields(selection, schema)
+            except ValueError:
+                invalid = mask
+            if invalid is not None:
+                return self._reply(400, {"error": {"code": 400, "message": f"Invalid field selection {invalid}",
+                                                   "errors": [{"domain": "global", "reason": "invalidParameter",
+                                                               "message": f"Invalid field selection {invalid}",
+                                                               "locationType": "parameter",
+                                                               "location": "fields"}]}})
+            body = select_fields(body, selection)
+        self._reply(status, body)
+
+    def _reply(self, status, body):
+        content = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        if content:
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            if "gzip" in self.headers.get("Accept-Encoding", ""):
+                content = gzip.compress(content)
+                self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        self.server.bytes_sent += len(content)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Google Calendar API v3 server")
+    parser.add_argument("--calendars", type=int, default=10)
+    parser.add_argument("--events", type=int, default=100, help="Events per calendar")
+    parser.add_argument("--days", type=int, default=30, help="Days the events are spread over")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a 503 response")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    server = FakeCalendarServer(FakeCalendarData(args.calendars, args.events, args.days),
+                                latency=args.latency, error_rate=args.error_rate, port=args.port)
+    print(f"Serving fake Calendar API at {server.url}")
+    server.serve_forever()
@@ -1,132 +1,544 @@
-from datetime import datetime, timedelta
-from dateutil.parser import parse
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import heapq
+from atomic_file import atomic_write
+from calendar_event import CalendarEvent
+from calendar_provider import CalendarProvider
+from event_store import EventStore
+from instrumentation import Metrics
+from metadata_cache import MetadataCache
+import json
 import os.path
 import pickle
+import threading
+import time
 
 
-class GoogleCalendar:
+class AuthorizationRequired(Exception):
     """
-    Helper class for interacting with the Google Calendar API from the Desktop Agenda application.
+    Raised by a sync when an account has no valid OAuth token, see GoogleCalendar.authorize()
+    """
+
+
+class _CoalescedProgress:
+    """
+    Reports the partial results of a sync at most once per `interval` seconds.
+    A report that comes too close to the previous one is delayed until the interval
+    expires rather than dropped, so the pages stored meanwhile are shown then.
+    """
+
+    def __init__(self, interval, report):
+        self._interval = interval
+        self._report = report
+        self._lock = threading.Lock()
+        self._report_lock = threading.Lock()  # Held while reporting, so finish() can wait for a report
+        self._last = 0  # time.monotonic() of the last report
+        self._timer = None  # Delayed report, it includes every progress made until it fires
+        self._finished = False
+
+    def __call__(self):
+        with self._lock:
+            if self._finished or self._timer is not None:
+                return
+            delay = self._last + self._interval - time.monotonic()
+            if delay > 0:
+                self._timer = threading.Timer(delay, self._flush)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+            self._last = time.monotonic()
+        self._send()
+
+    def finish(self):
+        """
+        Cancel the delayed report and wait for a report in progress, the final result supersedes them
+        """
+        with self._lock:
+            self._finished = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        with self._report_lock:
+            pass
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            self._last = time.monotonic()
+        self._send()
+
+    def _send(self):
+        with self._report_lock:
+            with self._lock:
+                if self._finished:
+                    return
+            self._report()
+
+
+class GoogleCalendar(CalendarProvider):
+    """
+    Calendar provider for the Google Calendar API.
     An API credentials file must be created before this application can use the API.
     https://console.developers.google.com/apis/credentials    
 
     Details of the Google Calendar API can be found here:
     https://developers.google.com/resources/api-libraries/documentation/calendar/v3/python/latest/calendar_v3.events.html#list
+
+    Creating an instance does not perform any network I/O or import the Google client
+    libraries. Authentication and the API service object are set up by the first sync,
+    using locally cached copies of the discovery document and the colors palette.
     """
 
     CLIENT_SECRETS_FILE = "credentials.json"
     TOKEN_DIR = os.path.expanduser("~/.dags")
     TOKEN_FILE = "token.pickle"
     API_SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
+    STORE_FILE = "events.sqlite"
+    DISCOVERY_FILE = "calendar-v3-discovery.json"
+    METADATA_FILE = "metadata.json"
+    CALENDAR_LIST_TTL = 60 * 60  # Seconds before the calendar list is revalidated
+    COLORS_TTL = 7 * 24 * 60 * 60  # Seconds before the colors palette is fetched again, it has no etag
+    FETCH_WORKERS = 8  # Max number of calendars queried concurrently
+    SYNC_PAGE_SIZE = 250  # Max number of events per page when syncing
+    SYNC_AHEAD = 7 * 24 * 60 * 60  # Seconds synced past the end of the window so it can slide forward
+    PROGRESS_INTERVAL = 0.25  # Min seconds between partial results reported during a sync
+    HTTP_TIMEOUT = 30  # Seconds
+
+    # Partial responses, only the fields used by the application are requested and stored
+    EVENT_FIELDS = ("items(id,status,summary,location,start,end,htmlLink,updated,reminders,"
+                    "organizer(email,displayName),creator(email,displayName),iCalUID,originalStartTime),"
+                    "defaultReminders,nextPageToken,nextSyncToken")
+    CALENDAR_LIST_FIELDS = "etag,items(id,colorId,selected,summary,summaryOverride,accessRole,primary)"
+    COLORS_FIELDS = "calendar"
+    # Rank of the events of a calendar by its access role, see CalendarEvent. The primary calendar ranks 0.
+    ACCESS_RANKS = {"owner": 1, "writer": 2, "reader": 3, "freeBusyReader": 4}
+
+    def __init__(self, fetch_workers=FETCH_WORKERS, data_dir=None, credentials=None, api_endpoint=None,
+                 metrics=None, account=None):
+        """
+        `data_dir` holds the OAuth token, the event store and the caches. It defaults to
+        TOKEN_DIR, or to a directory of its own under TOKEN_DIR for a named `account`,
+        so every Google account has its own credentials, service objects and store.
+        `credentials` and `api_endpoint` replace the user's OAuth token and the Google API
+        endpoint, e.g. to run against the fake server of the benchmark suite.
+        Sync phases, requests and errors are recorded in `metrics` when it is enabled.
+        """
+        if data_dir is None:
+            data_dir = self.TOKEN_DIR if account is None else os.path.join(self.TOKEN_DIR, "accounts", account)
+        self.account = account
+        self._data_dir = data_dir
+        self._metrics = metrics if metrics is not None else Metrics()
+        if not os.path.exists(self._data_dir):
+            os.makedirs(self._data_dir, 0o700)
+        self._store = EventStore(os.path.join(self._data_dir, self.STORE_FILE))
+
+        self._creds = credentials
+        self._api_endpoint = api_endpoint
+        self._service = None
+        self._discovery_doc = None
+
+        # httplib2 connections are not thread safe, so every pool worker gets its own service object
+        self._local = threading.local()
+        self._pool = None
+        if fetch_workers > 1:
+            self._pool = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="calendar-fetch")
+
+        self._metadata = MetadataCache(os.path.join(self._data_dir, self.METADATA_FILE))
+        self._colors = self._metadata.peek("colors") or {}
+        self._calendars = None  # (id, selected, color, name, rank) of the calendars last written to the event store
+        CalendarProvider.__init__(self)
+
+    @property
+    def name(self):
+        return "Google account {}".format(self.account) if self.account is not None else "Google account"
+
+    def _connect(self):
+        """
+        Authenticate and create the API service object.
+        Called by the first sync, so it runs on the sync worker thread.
+        """
+        from googleapiclient.discovery import build
 
-    def __init__(self):
-        if not os.path.exists(self.TOKEN_DIR):
-            os.mkdir(self.TOKEN_DIR, 0o700)
-        token_file = os.path.join(self.TOKEN_DIR, self.TOKEN_FILE)
+        creds = self._creds
+        if creds is None:
+            with self._metrics.phase("token_refresh"):
+                creds = self._load_credentials()
+
+        # Building from a cached discovery document avoids a request on every start
+        with self._metrics.phase("build_service"):
+            discovery_doc = self._read_cache(self.DISCOVERY_FILE)
+            if discovery_doc is not None:
+                service = self._build_service(discovery_doc, creds)
+            else:
+                service = build("calendar", "v3", http=self._authorized_http(creds), cache_discovery=False,
+                                client_options=self._client_options())
+                discovery_doc = service._rootDesc
+                self._write_cache(self.DISCOVERY_FILE, discovery_doc)
+
+        self._creds = creds
+        self._discovery_doc = discovery_doc
+        self._service = service
+
+    def _load_credentials(self):
+        """
+        Load the user's OAuth token, refreshing it when needed.
+        Raises AuthorizationRequired rather than asking the user, which would block the sync
+        until the consent in the browser is completed.
+        """
+        from google.auth.exceptions import RefreshError
+        from google.auth.transport.requests import Request
+
+        token_file = os.path.join(self._data_dir, self.TOKEN_FILE)
         creds = None
         if os.path.exists(token_file):
             with open(token_file, "rb") as token:
                 creds = pickle.load(token)
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                # TODO: This can raise an exception if the token.pickle file is too old?
-                creds.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(self.CLIENT_SECRETS_FILE, self.API_SCOPES)
-                creds = flow.run_local_server()
-            with open(token_file, "wb") as token:
-                pickle.dump(creds, token)
+        if creds and creds.valid:
+            return creds
+        if not creds or not creds.expired or not creds.refresh_token:
+            raise AuthorizationRequired(f"{self.name} needs authorization")
+        try:
+            creds.refresh(Request())
+        except RefreshError as err:
+            # e.g. invalid_grant when the token was revoked or has not been used for too long
+            raise AuthorizationRequired(f"{self.name} needs authorization: {err}") from err
+        self._save_credentials(creds)
+        return creds
 
-        self._service = build("calendar", "v3", credentials=creds)
-        self._colors = {}
+    def authorize(self):
+        """
+        Ask the user to authorize the account in the browser and save the OAuth token for the next sync.
+        Blocks until the consent is completed, so it runs on a thread of its own and never from a sync.
+        """
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_secrets_file(self.CLIENT_SECRETS_FILE, self.API_SCOPES)
+        self._save_credentials(flow.run_local_server(port=0))  # Any free port, accounts can be authorized together
+
+    def needs_authorization(self):
+        """
+        Whether the last sync failed for lack of a valid OAuth token
+        """
+        return isinstance(self.last_error, AuthorizationRequired)
+
+    def _save_credentials(self, creds):
+        with atomic_write(os.path.join(self._data_dir, self.TOKEN_FILE), "wb") as token:
+            pickle.dump(creds, token)
+
+    def _read_cache(self, name):
+        path = os.path.join(self._data_dir, name)
+        if not os.path.exists(path):
+            return None
         try:
-            self._colors = self._service.colors().get().execute()
-        except Exception as err:
-            print(f"Failed to load calendar colors from Calendar API: {err}")
+            with open(path) as cache:
+                return json.load(cache)
+        except ValueError as err:
+            print(f"Ignoring corrupt cache file {path}: {err}")
+            return None
 
-        self._events = []
+    def _write_cache(self, name, data):
+        with atomic_write(os.path.join(self._data_dir, name)) as cache:
+            json.dump(data, cache)
 
-    def load_events(self, date_handler=None, event_handler=None, days=7, max_results=30):
+    def fetch_events(self, days=7, max_results=30, on_progress=None):
         """
-        Query the API for calendar events
-        Trigger handlers and return events
+        Synchronize the local event store with the API and return the events of
+        the next `days` days as CalendarEvent records sorted by start time.
+        Calendars are synced incrementally with their sync token, so only changes
+        made since the previous sync are downloaded.
+        Full syncs download events in start time order and store them page by page.
+        `on_progress` is called with the partial agenda (in the same form as the result)
+        when the first page of a calendar arrives, so the next few hours can be shown
+        before the remaining pages are loaded. It is called from the sync threads, and first
+        pages arriving within PROGRESS_INTERVAL of each other are coalesced into one report.
+        This only performs I/O and does not modify the loaded events,
+        so it may be run from a background thread (see SyncWorker).
         """
-        now = datetime.utcnow()
-        query_start = now.isoformat() + "Z"
-        query_end = (now + timedelta(hours=days * 24)).isoformat() + "Z"
+        sync_start = time.perf_counter()
+        window_start = time.time()
+        window_end = window_start + days * 24 * 60 * 60
 
-        calendars = []
+        calendars = None
+        changes = {}
+        errors = []
         try:
+            if self._service is None:
+                self._connect()
             # calendars_result = self._service.calendarList().list(minAccessRole="owner").execute()
-            calendars_result = self._service.calendarList().list().execute()
+            with self._metrics.phase("calendar_list"):
+                calendars_result = self._metadata.get(
+                    "calendarList", self.CALENDAR_LIST_TTL,
+                    lambda: self._service.calendarList().list(fields=self.CALENDAR_LIST_FIELDS), self._execute,
+                    fields=self.CALENDAR_LIST_FIELDS)
             calendars = calendars_result.get("items", [])
+            self.last_error = None
         except Exception as err:
+            from google.auth.exceptions import RefreshError
+            if isinstance(err, RefreshError):
+                # The token was revoked since the service was created, connect again once authorized
+                self._service = None
+                self._creds = None
+                err = AuthorizationRequired(f"{self.name} needs authorization: {err}")
+            self._metrics.count("errors", phase="calendar_list")
             print(f"Failed to load calendars from Calendar API: {err}")
+            self.last_error = err
+            errors.append(err)
+
+        if calendars is None:
+            # Offline, show what was stored by previous syncs
+            calendar_ids = self._store.get_selected_calendars()
+        else:
+            self._load_colors(calendars)
 
-        shown_events = []
-        for cal in calendars:
-            calId = cal["id"]
-            selected = cal.get("selected", False)
-            if not selected:
-                continue
-
-            color_id = cal["colorId"]
-            color = self._colors.get("calendar", {"calendar": {}}).get(color_id, {"background": None})["background"]
-
-            events_result = None
-            try:
-                events_result = self._service.events().list(calendarId=calId,
-                                                            timeMin=query_start, timeMax=query_end,
-                                                            maxResults=max_results, singleEvents=True,
-                                                            orderBy="startTime").execute()
-                events = events_result.get("items", [])
-                reminders = events_result.get("defaultReminders", [])
-                for event in events:
-                    if color is not None:
-                        event["color"] = color
-                    event["reminders"] = reminders
-                    shown_events.append(event)
-            except Exception as err:
-                print(f"Failed to load events from Calendar API: {err}")
-
-        shown_events.sort(key=self.get_event_datetime)
-        self._events = shown_events
-
-        # Call handlers
-        self.get_events(date_handler, event_handler)
-
-        return self._events
-
-    def get_events(self, date_handler=None, event_handler=None):
-        """
-        Trigger handlers and return events previously loaded by load_events()
-        """
-        cur_date = None
-        for event in self._events:
-            event_date = self.get_event_datetime(event)
-            dt = parse(event_date)
-
-            if cur_date is not None:
-                cd = parse(cur_date)
-
-            if cur_date is None or dt.date() != cd.date():
-                cur_date = event_date
-                if date_handler is not None:
-                    if not date_handler(event_date):  # Allow handlers to cancel further processing
-                        print("date handler canceled processing")
-                        break
-
-            if event_handler is not None:
-                if not event_handler(event):  # Allow handlers to cancel further processing
-                    print("event handler canceled processing")
-                    break
-
-        return self._events
+            # Only write to the event store when a calendar's selection, color, name or rank changed
+            colors = {cal["id"]: self._get_calendar_color(cal) for cal in calendars}
+            ranks = {cal["id"]: self._get_calendar_rank(cal) for cal in calendars}
+            state = [(cal["id"], cal.get("selected", False), colors[cal["id"]],
+                      cal.get("summaryOverride", cal.get("summary", None)), ranks[cal["id"]]) for cal in calendars]
+            if state != self._calendars:
+                self._store.set_calendars(calendars, colors, ranks)
+                self._calendars = state
+
+            calendar_ids = [cal["id"] for cal in calendars if cal.get("selected", False)]
+
+            progress = None
+            if on_progress is not None:
+                progress = _CoalescedProgress(self.PROGRESS_INTERVAL, lambda: on_progress(
+                    self._query_store(calendar_ids, window_start, window_end, max_results)))
+
+            # Sync calendars concurrently, each calendar's failure only affects that calendar
+            if self._pool is not None:
+                futures = [self._pool.submit(self._sync_calendar, calendar_id, window_end, progress)
+                           for calendar_id in calendar_ids]
+                results = [future.result() for future in futures]
+            else:
+                results = [self._sync_calendar(calendar_id, window_end, progress) for calendar_id in calendar_ids]
+            if progress is not None:
+                progress.finish()
+            for calendar_id, (count, error) in zip(calendar_ids, results):
+                if error is None:
+                    changes[calendar_id] = count
+                else:
+                    errors.append(error)
+
+            self._store.prune(window_start)
+
+        shown_events = self._query_store(calendar_ids, window_start, window_end, max_results)
+        self.last_sync = (changes, errors)
+        self._metrics.observe("sync", time.perf_counter() - sync_start)
+        return shown_events
+
+    def load_cached_events(self, days=7, max_results=30):
+        """
+        Return the events of the next `days` days from the local event store without any network I/O
+        """
+        window_start = time.time()
+        window_end = window_start + days * 24 * 60 * 60
+        return self._query_store(self._store.get_selected_calendars(), window_start, window_end, max_results)
+
+    def _query_store(self, calendar_ids, window_start, window_end, max_results):
+        with self._metrics.phase("store_query"):
+            streams = self._store.query(calendar_ids, window_start, window_end, max_results)
+        # Each calendar's events are already ordered, so a k-way merge replaces a full sort
+        with self._metrics.phase("merge"):
+            shown_events = list(heapq.merge(*streams, key=self.get_event_datetime))
+        self._metrics.count("events", len(shown_events))
+        return shown_events
+
+    def invalidate_metadata(self):
+        """
+        Make the next sync revalidate the calendar list, e.g. when the user asks for a refresh
+        """
+        self._metadata.invalidate("calendarList")
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        self._store.close()
+
+    def _load_colors(self, calendars):
+        """
+        Load the colors palette, revalidating it early when a calendar uses a color it does not contain
+        """
+        palette = self._colors.get("calendar", {})
+        if any(cal.get("colorId", None) not in (None, *palette) for cal in calendars):
+            self._metadata.invalidate("colors")
+        try:
+            self._colors = self._metadata.get(
+                "colors", self.COLORS_TTL,
+                lambda: self._service.colors().get(fields=self.COLORS_FIELDS), self._execute,
+                fields=self.COLORS_FIELDS)
+        except Exception as err:
+            print(f"Failed to load calendar colors from Calendar API: {err}")
+
+    def get_palette(self):
+        return [color["background"] for color in self._colors.get("calendar", {}).values()]
+
+    def _get_calendar_color(self, cal):
+        color_id = cal.get("colorId", None)
+        return self._colors.get("calendar", {}).get(color_id, {"background": None})["background"]
+
+    def _get_calendar_rank(self, cal):
+        if cal.get("primary", False):
+            return 0
+        return self.ACCESS_RANKS.get(cal.get("accessRole", None), CalendarEvent.DEFAULT_RANK)
+
+    def _sync_calendar(self, calendar_id, window_end, progress=None):
+        """
+        Bring the stored events of a single calendar up to date.
+        An incremental sync is used when the calendar has a sync token. When the requested
+        window reaches past the stored events, only the additional range is listed first.
+        Without a sync token, a full sync is performed.
+        `progress` is called once the first page of a full sync has been stored.
+        Returns the number of changed events (None after a full sync) and the error, if any.
+        Runs on a pool worker when concurrent fetching is enabled.
+        """
+        from googleapiclient.errors import HttpError
+
+        phase_start = time.perf_counter()
+        try:
+            state = self._store.get_sync_state(calendar_id)
+            if state is not None:
+                sync_token, synced_from, synced_until = state
+                mode = "delta"
+                if synced_until < window_end:
+                    # The window widened, list only the range beyond the stored events.
+                    # Changes made meanwhile are picked up by the incremental sync below.
+                    sync_end = window_end + self.SYNC_AHEAD
+                    events, _, _ = self._list_events(calendarId=calendar_id, orderBy="startTime",
+                                                     timeMin=self._format_timestamp(synced_until),
+                                                     timeMax=self._format_timestamp(sync_end))
+                    self._store.extend_window(calendar_id, events, sync_end)
+                    mode = "extend"
+                try:
+                    events, reminders, sync_token = self._list_events(calendarId=calendar_id, syncToken=sync_token)
+                    self._store.apply_changes(calendar_id, events, reminders, sync_token)
+                    self._metrics.observe("sync_calendar", time.perf_counter() - phase_start,
+                                          calendar=calendar_id, mode=mode)
+                    return len(events), None
+                except HttpError as err:
+                    if err.resp.status != 410:
+                        raise
+                    # The sync token is no longer valid, start over with a full sync
+                    print(f"Sync token expired for calendar {calendar_id}, performing full sync")
+                    self._store.reset_calendar(calendar_id)
+
+            # Start the full sync at midnight so events later today can be shown
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+            sync_end = window_end + self.SYNC_AHEAD
+            pages = [0]
+
+            def store_page(events):
+                if pages[0] == 0:
+                    self._store.begin_full_sync(calendar_id, events)
+                    if progress is not None:
+                        progress()
+                else:
+                    self._store.add_events(calendar_id, events)
+                pages[0] += 1
+
+            # Ordered by start time, so the stored pages always hold the earliest events
+            events, reminders, sync_token = self._list_events(on_page=store_page, calendarId=calendar_id,
+                                                              orderBy="startTime",
+                                                              timeMin=self._format_timestamp(today),
+                                                              timeMax=self._format_timestamp(sync_end))
+            self._store.finish_full_sync(calendar_id, reminders, sync_token, today, sync_end)
+            self._metrics.observe("sync_calendar", time.perf_counter() - phase_start,
+                                  calendar=calendar_id, mode="full")
+            return None, None
+        except Exception as err:
+            self._metrics.count("errors", phase="sync_calendar", calendar=calendar_id)
+            print(f"Failed to sync calendar {calendar_id} with Calendar API: {err}")
+            return None, err
+
+    def _list_events(self, on_page=None, **kwargs):
+        """
+        Follow the pages of an events().list query.
+        Returns the events, the calendar's default reminders and the next sync token.
+        When `on_page` is given, it is called with the events of each page instead of
+        collecting them, and the returned events are empty.
+        """
+        service = self._get_service()
+        events = []
+        page_token = None
+        while True:
+            events_result = self._execute(service.events().list(maxResults=self.SYNC_PAGE_SIZE, singleEvents=True,
+                                                                pageToken=page_token, fields=self.EVENT_FIELDS,
+                                                                **kwargs))
+            if on_page is not None:
+                on_page(events_result.get("items", []))
+            else:
+                events.extend(events_result.get("items", []))
+            page_token = events_result.get("nextPageToken", None)
+            if page_token is None:
+                return events, events_result.get("defaultReminders", []), events_result.get("nextSyncToken", None)
 
     @staticmethod
-    def get_event_datetime(event):
-        ev = event["start"].get("dateTime", event["start"].get("date"))
-        return ev
+    def _format_timestamp(timestamp):
+        return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+    def _get_service(self):
+        """
+        Return the API service object owned by the calling thread
+        """
+        if self._pool is None:
+            return self._service
+        service = getattr(self._local, "service", None)
+        if service is None or self._local.creds is not self._creds:
+            # Reuse the already loaded discovery document, this does not make any request.
+            # Rebuilt when the account was authorized again since.
+            service = self._build_service(self._discovery_doc, self._creds)
+            self._local.service = service
+            self._local.creds = self._creds
+        return service
+
+    def _build_service(self, discovery_doc, creds):
+        from googleapiclient.discovery import build_from_document
+        return build_from_document(discovery_doc, http=self._authorized_http(creds),
+                                   client_options=self._client_options())
+
+    def _client_options(self):
+        if self._api_endpoint is None:
+            return None
+        return {"api_endpoint": self._api_endpoint}
+
+    def _authorized_http(self, creds):
+        """
+        Create an HTTP client with a request timeout that authorizes requests with the given credentials
+        """
+        import google_auth_httplib2
+        import httplib2
+        return google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=self.HTTP_TIMEOUT))
+
+    def _execute(self, request):
+        """
+        Execute an API request with a compressed response
+        """
+        request.headers["accept-encoding"] = "gzip"
+        if "(gzip)" not in request.headers.get("user-agent", ""):
+            # Google APIs only compress responses for user agents containing "gzip"
+            request.headers["user-agent"] = "{} (gzip)".format(request.headers.get("user-agent", "desktop-agenda"))
+        if not self._metrics.enabled:
+            return request.execute()
+
+        method = request.methodId
+        self._metrics.count("requests", method=method)
+        postproc = request.postproc
+
+        def count_bytes(resp, content):
+            # httplib2 has already decompressed the content and rewritten its content-length at this
+            # point, so this counts the size after decompression. The benchmark measures the transfer.
+            self._metrics.count("bytes_decompressed", len(content), method=method)
+            return postproc(resp, content)
+
+        request.postproc = count_bytes
+        start = time.perf_counter()
+        try:
+            return request.execute()
+        except Exception as err:
+            # 304 Not Modified is the expected answer of a metadata revalidation
+            if getattr(getattr(err, "resp", None), "status", None) != 304:
+                self._metrics.count("errors", phase="request", method=method)
+            raise
+        finally:
+            self._metrics.observe("request", time.perf_counter() - start, method=method)
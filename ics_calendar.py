@@ -0,0 +1,308 @@
+from calendar_event import CalendarEvent
+from calendar_provider import CalendarProvider
+from datetime import date, datetime, time, timedelta, timezone
+from dateutil.tz import gettz, tzlocal
+import mmap
+import os.path
+import re
+import threading
+
+DURATION_PATTERN = re.compile(r"^([-+])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+
+class IcsCalendar(CalendarProvider):
+    """
+    Calendar provider for a local iCalendar (.ics) file, such as a calendar export or a
+    CalDAV feed downloaded by another tool.
+    The file is memory-mapped and parsed one content line at a time, keeping only the
+    properties the agenda shows. Recurring events (RRULE, RDATE, EXDATE and RECURRENCE-ID
+    overrides) are only expanded within the query window.
+    Parsed events are cached by file modification time and size, and the expansion by the
+    same key plus the window, so reading an unchanged file costs a single stat() call.
+    """
+
+    RANK = 5  # Copies of events shared with a Google calendar are shown from the Google calendar
+
+    def __init__(self, path, color=None):
+        CalendarProvider.__init__(self)
+        self.path = os.path.expanduser(path)
+        self.calendar_id = "ics:" + self.path
+        self.color = color
+        self._lock = threading.Lock()
+        self._components = []  # Parsed VEVENTs of the file
+        self._components_key = None  # (mtime, size) of the parsed file
+        self._expansion = []  # Expanded events of the cached window
+        self._expansion_key = None  # (mtime, size, first day, days) of the cached window
+
+    def fetch_events(self, days=7, max_results=30, on_progress=None):
+        try:
+            events = self._expanded(days)
+        except OSError as err:
+            self.last_error = err
+            self.last_sync = ({}, [err])
+            return []
+        self.last_error = None
+        self.last_sync = ({}, [])
+        return self._window(events, days, max_results)
+
+    def load_cached_events(self, days=7, max_results=30):
+        # Reading the file is local I/O too, so the startup paint already shows its events
+        try:
+            events = self._expanded(days)
+        except OSError:
+            return []
+        return self._window(events, days, max_results)
+
+    def _expanded(self, days):
+        """
+        Return the events of the file expanded over the next `days` days, reusing the cached
+        expansion while the file and the window are unchanged. Raises OSError when the file is unreadable.
+        """
+        stat = os.stat(self.path)
+        file_key = (stat.st_mtime_ns, stat.st_size)
+        today = date.today()
+        with self._lock:
+            if self._expansion_key != file_key + (today, days):
+                if self._components_key != file_key:
+                    self._components = self._parse()
+                    self._components_key = file_key
+                window_start = datetime.combine(today, time.min, tzinfo=tzlocal())
+                self._expansion = self._expand(window_start, window_start + timedelta(days=days + 1))
+                self._expansion_key = file_key + (today, days)
+            return self._expansion
+
+    @property
+    def name(self):
+        return "calendar file {}".format(self.path)
+
+    def get_palette(self):
+        return [self.color] if self.color is not None else []
+
+    @staticmethod
+    def _window(events, days, max_results):
+        """
+        Return up to max_results events overlapping the next `days` days
+        """
+        now = datetime.now(tzlocal())
+        window_end = now + timedelta(days=days)
+        shown_events = []
+        for event in events:
+            if event.start >= window_end or len(shown_events) >= max_results:
+                break
+            if event.end > now:
+                shown_events.append(event)
+        return shown_events
+
+    def _parse(self):
+        """
+        Parse the VEVENT components of the file
+        """
+        components = []
+        with open(self.path, "rb") as ics:
+            if os.fstat(ics.fileno()).st_size == 0:
+                return components
+            with mmap.mmap(ics.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                stack = []
+                component = None
+                alarm = None
+                position = 0  # Of the VEVENT in the file
+                for name, params, value in self._content_lines(data):
+                    if name == "BEGIN":
+                        stack.append(value.upper())
+                        if value.upper() == "VEVENT":
+                            component = {"EXDATE": [], "RDATE": [], "VALARM": []}
+                        elif value.upper() == "VALARM" and component is not None:
+                            alarm = {}
+                    elif name == "END":
+                        if stack:
+                            stack.pop()
+                        if value.upper() == "VEVENT" and component is not None:
+                            try:
+                                components.append(self._read_component(component, position))
+                            except (KeyError, ValueError) as err:
+                                print(f"Skipping invalid event in {self.path}: {err}")
+                            component = None
+                            position += 1
+                        elif value.upper() == "VALARM" and alarm is not None:
+                            component["VALARM"].append(alarm)
+                            alarm = None
+                    elif alarm is not None:
+                        alarm[name] = (params, value)
+                    elif component is not None and stack[-1] == "VEVENT":
+                        if name in ("EXDATE", "RDATE"):
+                            component[name].append((params, value))
+                        else:
+                            component[name] = (params, value)
+        return components
+
+    @staticmethod
+    def _content_lines(data):
+        """
+        Yield the (name, parameters, value) of each unfolded content line
+        """
+        line = None
+        for raw in iter(data.readline, b""):
+            raw = raw.rstrip(b"\r\n")
+            if raw[:1] in (b" ", b"\t"):
+                # Folded line, continues the previous one
+                if line is not None:
+                    line += raw[1:]
+                continue
+            if line:
+                yield IcsCalendar._split_line(line.decode("utf-8", "replace"))
+            line = raw
+        if line:
+            yield IcsCalendar._split_line(line.decode("utf-8", "replace"))
+
+    @staticmethod
+    def _split_line(line):
+        quoted = False
+        for i, char in enumerate(line):
+            if char == "\"":
+                quoted = not quoted
+            elif char == ":" and not quoted:
+                break
+        else:
+            return line.upper(), {}, ""
+        name, *params = line[:i].split(";")
+        params = dict(param.split("=", 1) for param in params if "=" in param)
+        return name.upper(), {key.upper(): value.strip("\"") for key, value in params.items()}, line[i + 1:]
+
+    def _read_component(self, component, position):
+        """
+        Parse the properties of a VEVENT. An event without a UID, which is invalid but found in
+        exported files, is identified by its `position` in the file instead and never collapsed
+        with the copies of another calendar.
+        """
+        start, all_day = self._parse_datetime(*component["DTSTART"])
+        if "DTEND" in component:
+            duration = self._parse_datetime(*component["DTEND"])[0] - start
+        elif "DURATION" in component:
+            duration = self._parse_duration(component["DURATION"][1])
+        else:
+            duration = timedelta(days=1) if all_day else timedelta()
+
+        organizer = None
+        if "ORGANIZER" in component:
+            params, value = component["ORGANIZER"]
+            organizer = params.get("CN", re.sub(r"^mailto:", "", value, flags=re.IGNORECASE))
+
+        recurrence_id = None
+        if "RECURRENCE-ID" in component:
+            recurrence_id = self._parse_datetime(*component["RECURRENCE-ID"])[0].timestamp()
+
+        reminders = []
+        for alarm in component["VALARM"]:
+            trigger = alarm.get("TRIGGER", None)
+            if trigger is None or trigger[0].get("RELATED", "START") != "START" or trigger[0].get("VALUE") == "DATE-TIME":
+                continue
+            minutes = -self._parse_duration(trigger[1]).total_seconds() // 60
+            if minutes > 0:
+                reminders.append(int(minutes))
+
+        return {
+            "uid": component["UID"][1] if "UID" in component else None,
+            "key": component["UID"][1] if "UID" in component else "#{}".format(position),
+            "summary": self._unescape(component.get("SUMMARY", (None, "(No title)"))[1]),
+            "location": self._unescape(component["LOCATION"][1]) if "LOCATION" in component else None,
+            "url": component.get("URL", (None, None))[1],
+            "organizer": organizer,
+            "updated": component.get("LAST-MODIFIED", component.get("DTSTAMP", (None, None)))[1],
+            "start": start,
+            "all_day": all_day,
+            "duration": duration,
+            "rrule": component.get("RRULE", (None, None))[1],
+            "rdates": [dt for params, value in component["RDATE"] for dt in self._parse_datetimes(params, value)],
+            "exdates": {dt.timestamp() for params, value in component["EXDATE"]
+                        for dt in self._parse_datetimes(params, value)},
+            "recurrence_id": recurrence_id,
+            "cancelled": component.get("STATUS", (None, ""))[1].upper() == "CANCELLED",
+            "reminders": tuple(sorted(reminders)),
+        }
+
+    def _expand(self, window_start, window_end):
+        """
+        Return the events and recurrence instances overlapping [window_start, window_end) sorted by start time
+        """
+        from dateutil.rrule import rrulestr
+
+        overrides = {(c["key"], c["recurrence_id"]) for c in self._components if c["recurrence_id"] is not None}
+        events = []
+        for c in self._components:
+            if c["cancelled"]:
+                continue
+            duration = c["duration"]
+            recurring = c["recurrence_id"] is None and (c["rrule"] is not None or c["rdates"])
+            if not recurring:
+                starts = [c["start"]]
+            elif c["rrule"] is not None:
+                starts = self._rrule_between(rrulestr, c, window_start - duration, window_end) + c["rdates"]
+            else:
+                starts = [c["start"]] + c["rdates"]
+
+            for start in starts:
+                if start + duration <= window_start or start >= window_end:
+                    continue
+                if recurring:
+                    timestamp = start.timestamp()
+                    if timestamp in c["exdates"] or (c["key"], timestamp) in overrides:
+                        continue
+                events.append(self._make_event(c, start))
+
+        events.sort(key=self.get_event_datetime)
+        return events
+
+    @staticmethod
+    def _rrule_between(rrulestr, component, after, before):
+        start = component["start"]
+        try:
+            rule = rrulestr(component["rrule"], dtstart=start)
+            return rule.between(after, before, inc=True)
+        except ValueError:
+            # UNTIL given as a floating or date value, expand in the event's own wall time
+            tz = start.tzinfo
+            rule = rrulestr(component["rrule"], dtstart=start.replace(tzinfo=None), ignoretz=True)
+            return [dt.replace(tzinfo=tz) for dt in rule.between(after.astimezone(tz).replace(tzinfo=None),
+                                                                 before.astimezone(tz).replace(tzinfo=None),
+                                                                 inc=True)]
+
+    def _make_event(self, component, start):
+        start = start.astimezone(tzlocal())
+        return CalendarEvent("{}/{}".format(component["key"], int(start.timestamp())), self.calendar_id,
+                             component["updated"], component["summary"], component["location"],
+                             component["organizer"], component["url"], start, start + component["duration"],
+                             component["all_day"], self.color, component["reminders"], component["uid"],
+                             component["recurrence_id"], os.path.basename(self.path), self.RANK)
+
+    @staticmethod
+    def _parse_datetime(params, value):
+        """
+        Parse a DATE or DATE-TIME value.
+        Returns the timezone aware datetime and whether it is a DATE; floating times and dates are local.
+        """
+        value = value.strip()
+        if params.get("VALUE", None) == "DATE" or len(value) == 8:
+            return datetime.combine(datetime.strptime(value[:8], "%Y%m%d").date(), time.min, tzinfo=tzlocal()), True
+        dt = datetime.strptime(value[:15], "%Y%m%dT%H%M%S")
+        if value.endswith("Z"):
+            return dt.replace(tzinfo=timezone.utc), False
+        tz = gettz(params["TZID"]) if "TZID" in params else None
+        return dt.replace(tzinfo=tz if tz is not None else tzlocal()), False
+
+    @staticmethod
+    def _parse_datetimes(params, value):
+        return [IcsCalendar._parse_datetime(params, item)[0] for item in value.split(",") if item.strip()]
+
+    @staticmethod
+    def _parse_duration(value):
+        match = DURATION_PATTERN.match(value.strip())
+        if match is None:
+            raise ValueError(f"Invalid duration {value}")
+        sign, weeks, days, hours, minutes, seconds = match.groups()
+        duration = timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                             minutes=int(minutes or 0), seconds=int(seconds or 0))
+        return -duration if sign == "-" else duration
+
+    @staticmethod
+    def _unescape(text):
+        return re.sub(r"\\([\\;,nN])", lambda m: "\n" if m.group(1) in "nN" else m.group(1), text)
@@ -0,0 +1,148 @@
+from atomic_file import atomic_write
+from collections import deque
+import json
+import os.path
+import threading
+import time
+
+
+class _NullPhase:
+    """
+    Phase returned while instrumentation is disabled, entering and leaving it does nothing
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+
+    def __init__(self, metrics, name, labels):
+        self._metrics = metrics
+        self._name = name
+        self._labels = labels
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.observe(self._name, time.perf_counter() - self._start, **self._labels)
+        if exc_type is not None:
+            self._metrics.count("errors", phase=self._name)
+        return False
+
+
+class Metrics:
+    """
+    Performance records of the sync and render phases of the Desktop Agenda application.
+    Durations (in seconds) and counters are appended to a fixed size ring buffer and summed
+    into running totals, which can be exported as JSON lines or as a Prometheus textfile.
+    When disabled, phase() returns a shared no-op context manager and the other methods
+    return immediately, so instrumented code costs next to nothing.
+    Safe to use from any thread.
+    """
+
+    CAPACITY = 2000  # Number of records kept in the ring buffer
+
+    def __init__(self, enabled=False, export_path=None, capacity=CAPACITY):
+        self.enabled = enabled
+        self.export_path = export_path
+        self._records = deque(maxlen=capacity)  # (timestamp, kind, name, labels, value)
+        self._totals = {}  # (kind, name, labels) -> [count, sum, max]
+        self._lock = threading.Lock()
+        self._exported = 0  # Number of records already appended to the JSON lines export
+
+    def phase(self, name, **labels):
+        """
+        Context manager measuring the duration of a phase, e.g.
+        with metrics.phase("events_list", calendar=calendar_id):
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name, labels)
+
+    def observe(self, name, seconds, **labels):
+        if self.enabled:
+            self._record("duration", name, seconds, labels)
+
+    def count(self, name, value=1, **labels):
+        if self.enabled:
+            self._record("count", name, value, labels)
+
+    def _record(self, kind, name, value, labels):
+        labels = tuple(sorted(labels.items()))
+        with self._lock:
+            self._records.append((time.time(), kind, name, labels, value))
+            self._exported += 1
+            total = self._totals.get((kind, name, labels), None)
+            if total is None:
+                self._totals[(kind, name, labels)] = [1, value, value]
+            else:
+                total[0] += 1
+                total[1] += value
+                total[2] = max(total[2], value)
+
+    def summary(self):
+        """
+        Human readable totals, one line per phase or counter
+        """
+        with self._lock:
+            totals = sorted(self._totals.items())
+        lines = []
+        for (kind, name, labels), (count, total, maximum) in totals:
+            label = name + "".join(f" {key}={value}" for key, value in labels)
+            if kind == "duration":
+                lines.append(f"{label}: {count} x, mean {total / count * 1000:.1f} ms, "
+                             f"max {maximum * 1000:.1f} ms")
+            else:
+                lines.append(f"{label}: {total}")
+        return "\n".join(lines) if lines else "No measurements recorded yet"
+
+    def export(self):
+        """
+        Write the measurements to export_path.
+        A path ending in .prom gets a Prometheus textfile of the running totals,
+        any other path gets the new records appended as JSON lines.
+        """
+        if not self.enabled or self.export_path is None:
+            return
+        try:
+            if self.export_path.endswith(".prom"):
+                self._export_prometheus()
+            else:
+                self._export_json_lines()
+        except OSError as err:
+            print(f"Failed to export metrics to {self.export_path}: {err}")
+
+    def _export_json_lines(self):
+        with self._lock:
+            count = min(self._exported, len(self._records))
+            records = list(self._records)[len(self._records) - count:]
+            self._exported = 0
+        with open(os.path.expanduser(self.export_path), "a") as export:
+            for timestamp, kind, name, labels, value in records:
+                export.write(json.dumps({"time": timestamp, "kind": kind, "name": name,
+                                         "labels": dict(labels), "value": value}) + "\n")
+
+    def _export_prometheus(self):
+        with self._lock:
+            totals = sorted(self._totals.items())
+        lines = []
+        for (kind, name, labels), (count, total, maximum) in totals:
+            label = ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"')) for key, value in labels)
+            label = "{" + label + "}" if label else ""
+            if kind == "duration":
+                lines.append(f"desktop_agenda_{name}_seconds_sum{label} {total}")
+                lines.append(f"desktop_agenda_{name}_seconds_count{label} {count}")
+            else:
+                lines.append(f"desktop_agenda_{name}_total{label} {total}")
+        with atomic_write(os.path.expanduser(self.export_path)) as export:
+            export.write("\n".join(lines) + "\n")
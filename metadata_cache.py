@@ -0,0 +1,80 @@
+from atomic_file import atomic_write
+import json
+import os.path
+import threading
+import time
+
+
+class MetadataCache:
+    """
+    Persistent cache of Calendar API metadata responses such as the calendar list and the colors palette.
+    A cached response is used as is until its time-to-live expires. It is then revalidated with
+    its etag, so an unchanged resource only costs a 304 Not Modified response. Responses without
+    an etag in their body, such as the colors palette, are fetched again instead.
+    The cache is saved to disk after every change so it survives restarts.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries = {}  # name -> {"etag": etag, "fetched": timestamp, "payload": response, "fields": mask}
+        if os.path.exists(path):
+            try:
+                with open(path) as cache:
+                    self._entries = json.load(cache)
+            except ValueError as err:
+                print(f"Ignoring corrupt metadata cache {path}: {err}")
+
+    def peek(self, name):
+        """
+        Return the cached response without checking its age, or None
+        """
+        with self._lock:
+            entry = self._entries.get(name, None)
+        return entry["payload"] if entry is not None else None
+
+    def get(self, name, ttl, request, execute, fields=None):
+        """
+        Return the response of an API request, from the cache when it is younger than `ttl` seconds.
+        `request` creates the API request and `execute` executes it. `fields` is the partial
+        response mask of the request, a response cached with another mask is fetched again.
+        """
+        from googleapiclient.errors import HttpError
+
+        with self._lock:
+            entry = self._entries.get(name, None)
+        if entry is not None and entry.get("fields", None) != fields:
+            entry = None
+        now = time.time()
+        if entry is not None and now - entry["fetched"] < ttl:
+            return entry["payload"]
+
+        api_request = request()
+        if entry is not None and entry["etag"] is not None:
+            api_request.headers["if-none-match"] = entry["etag"]
+        try:
+            payload = execute(api_request)
+            entry = {"etag": payload.get("etag", None), "fetched": now, "payload": payload, "fields": fields}
+        except HttpError as err:
+            if entry is None or err.resp.status != 304:
+                raise
+            entry = dict(entry, fetched=now)
+
+        with self._lock:
+            self._entries[name] = entry
+            self._save()
+        return entry["payload"]
+
+    def invalidate(self, name):
+        """
+        Force the next get() of a resource to revalidate it with the API
+        """
+        with self._lock:
+            entry = self._entries.get(name, None)
+            if entry is not None:
+                self._entries[name] = dict(entry, fetched=0)
+                self._save()
+
+    def _save(self):
+        with atomic_write(self._path) as cache:
+            json.dump(self._entries, cache)
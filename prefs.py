@@ -1,15 +1,14 @@
+from atomic_file import atomic_write
 import json
 import os.path
 import gi
 gi.require_version("Gtk", "3.0")
-from gi.repository import Gtk
+from gi.repository import Gio, Gtk
 
 """
 TODO:
 Add "Load on startup" checkbox option.
 Needs to create ~/.config/autostart/desktop-agenda.desktop link to /usr/share/applications/desktop-agenda.desktop
-
-On Apply, update app to reflect new preferences
 """
 
 
@@ -22,12 +21,23 @@ class PrefsWindow(Gtk.Window):
     PREF_QUERY_LIMIT = "queryLimit"
     PREF_STYLE_CALENDAR_COLORS = "styleCalendarColors"
     PREF_SCREEN_POSITION = "screenPosition"
+    PREF_METRICS_ENABLED = "metricsEnabled"
+    PREF_METRICS_EXPORT = "metricsExport"
+    PREF_ICS_FILES = "icsFiles"
+    PREF_ACCOUNTS = "accounts"
+    PREF_RENDERER = "renderer"
+    RENDERERS = ("widgets", "canvas")
 
     def __init__(self):
         self._query_days = 7
         self._query_limit = 20  # Max number of items to query per calendar
         self._style_calendar_colors = True  # Whether to use calendar colors from API
-        self._screen_position = "right"  # TODO: Make an enum or reuse some Gtk.halign value
+        self._screen_position = "right"  # "left" or "right" TODO: Make an enum or reuse some Gtk.halign value
+        self._metrics_enabled = False  # Whether to record performance measurements
+        self._metrics_export = None  # JSON lines file, or Prometheus textfile if it ends in .prom
+        self._ics_files = []  # Local iCalendar files shown alongside the Google calendars
+        self._accounts = []  # Names of additional Google accounts, each with its own token under ~/.dags/accounts
+        self._renderer = "widgets"  # One label widget per cell, or "canvas" to draw the agenda on one surface
         self.load_preferences()
 
         Gtk.Window.__init__(self)
@@ -69,6 +79,39 @@ class PrefsWindow(Gtk.Window):
         # TODO: Validate enum
         self._screen_position = screen_position
 
+    def get_metrics_enabled(self):
+        return self._metrics_enabled
+
+    def set_metrics_enabled(self, metrics_enabled):
+        self._metrics_enabled = bool(metrics_enabled)
+
+    def get_metrics_export(self):
+        return self._metrics_export
+
+    def set_metrics_export(self, metrics_export):
+        self._metrics_export = metrics_export or None
+
+    def get_ics_files(self):
+        return self._ics_files
+
+    def set_ics_files(self, ics_files):
+        self._ics_files = [str(path) for path in ics_files or []]
+
+    def get_accounts(self):
+        return self._accounts
+
+    def set_accounts(self, accounts):
+        # Account names are used as directory names
+        self._accounts = [str(account) for account in accounts or []
+                          if str(account).strip(". ") and "/" not in str(account)]
+
+    def get_renderer(self):
+        return self._renderer
+
+    def set_renderer(self, renderer):
+        if renderer in self.RENDERERS:
+            self._renderer = renderer
+
     def load_preferences(self):
         prefs_file = os.path.join(self.PREFS_DIR, self.PREFS_FILE)
         if not os.path.exists(prefs_file):
@@ -76,13 +119,23 @@ class PrefsWindow(Gtk.Window):
             self.save_preferences()
             return
 
-        prefs = json.load(open(prefs_file))
+        try:
+            with open(prefs_file) as f:
+                prefs = json.load(f)
+        except ValueError as err:
+            print(f"Failed to load preferences: {err}")
+            return
 
         # Look for values in JSON, continue using current value if item isn't in config
         self.set_query_days(prefs.get(self.PREF_QUERY_DAYS, self._query_days))
         self.set_query_limit(prefs.get(self.PREF_QUERY_LIMIT, self._query_limit))
         self.set_style_calendar_colors(prefs.get(self.PREF_STYLE_CALENDAR_COLORS, self._style_calendar_colors))
         self.set_screen_position(prefs.get(self.PREF_SCREEN_POSITION, self._screen_position))
+        self.set_metrics_enabled(prefs.get(self.PREF_METRICS_ENABLED, self._metrics_enabled))
+        self.set_metrics_export(prefs.get(self.PREF_METRICS_EXPORT, self._metrics_export))
+        self.set_ics_files(prefs.get(self.PREF_ICS_FILES, self._ics_files))
+        self.set_accounts(prefs.get(self.PREF_ACCOUNTS, self._accounts))
+        self.set_renderer(prefs.get(self.PREF_RENDERER, self._renderer))
 
         print("Loaded preferences")
 
@@ -94,10 +147,29 @@ class PrefsWindow(Gtk.Window):
             self.PREF_QUERY_DAYS: self.get_query_days(),
             self.PREF_QUERY_LIMIT: self.get_query_limit(),
             self.PREF_STYLE_CALENDAR_COLORS: self.get_style_calendar_colors(),
-            self.PREF_SCREEN_POSITION: self.get_screen_position()
+            self.PREF_SCREEN_POSITION: self.get_screen_position(),
+            self.PREF_METRICS_ENABLED: self.get_metrics_enabled(),
+            self.PREF_METRICS_EXPORT: self.get_metrics_export(),
+            self.PREF_ICS_FILES: self.get_ics_files(),
+            self.PREF_ACCOUNTS: self.get_accounts(),
+            self.PREF_RENDERER: self.get_renderer()
         }
 
-        prefs_file = os.path.join(self.PREFS_DIR, self.PREFS_FILE)
-        json.dump(prefs, open(prefs_file, "w"))
+        with atomic_write(os.path.join(self.PREFS_DIR, self.PREFS_FILE)) as f:
+            json.dump(prefs, f)
 
         print("Saved preferences")
+
+    def watch(self, on_changed):
+        """
+        Reload the preferences whenever the file changes on disk, then call on_changed()
+        """
+        prefs_file = Gio.File.new_for_path(os.path.join(self.PREFS_DIR, self.PREFS_FILE))
+        self._monitor = prefs_file.monitor_file(Gio.FileMonitorFlags.NONE, None)
+        self._monitor.connect("changed", self._on_file_changed, on_changed)
+
+    def _on_file_changed(self, monitor, file, other_file, event_type, on_changed):
+        # Atomic saves replace the file, which is reported as created
+        if event_type in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED):
+            self.load_preferences()
+            on_changed()
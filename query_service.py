@@ -0,0 +1,186 @@
+from datetime import date, datetime
+from dateutil.tz import tzlocal
+import json
+import math
+import os.path
+import socket
+import time
+
+SOCKET_NAME = "desktop-agenda.sock"
+
+
+def socket_path():
+    """
+    Path of the query socket, in the user's runtime directory when there is one
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", None) or os.path.expanduser("~/.dags")
+    return os.path.join(runtime_dir, SOCKET_NAME)
+
+
+class QueryService:
+    """
+    Local query service answering agenda queries from the events the application holds in memory,
+    so status bars and scripts do not each poll the Calendar API.
+    Clients connect to a Unix domain socket and send one JSON object per line:
+      {"query": "next", "count": 5}                  events not ended yet, in start order
+      {"query": "today"}                              events taking place today
+      {"query": "range", "start": ISO, "end": ISO}    events overlapping [start, end)
+      {"query": "subscribe"}                          the upcoming events now and after each sync
+    Every answer is a JSON line with "events" (see CalendarEvent.to_dict) or "error".
+    The socket also enforces a single running instance: bind() fails while another
+    instance answers on it. Clients are served on the GTK main loop; a subscriber that
+    does not keep up with the pushed updates is disconnected rather than blocking it.
+    GLib is only imported once the service starts, so the headless agenda can query the
+    socket without it (see agenda_cli.py).
+    """
+
+    DEFAULT_COUNT = 5
+    MAX_REQUEST = 64 * 1024  # Max bytes of a request line
+
+    def __init__(self, path=None):
+        self.path = path if path is not None else socket_path()
+        self.calendar = None
+        self._server = None
+        self._clients = {}  # socket -> [bytes received, GLib watch id]
+        self._subscribers = set()
+
+    def bind(self):
+        """
+        Listen on the socket. Returns False when another instance is already listening.
+        """
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+            return False
+        except OSError:
+            pass  # Nobody is listening, a socket file left by a crashed instance is replaced
+        finally:
+            probe.close()
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path), 0o700, exist_ok=True)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        self._server.setblocking(False)
+        return True
+
+    def start(self, calendar):
+        """
+        Answer queries from the events loaded in the given CalendarProvider
+        """
+        from gi.repository import GLib
+
+        self.calendar = calendar
+        GLib.io_add_watch(self._server.fileno(), GLib.PRIORITY_DEFAULT, GLib.IO_IN, self._on_accept)
+
+    def stop(self):
+        for client in list(self._clients):
+            self._close(client)
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            os.unlink(self.path)
+
+    def publish(self):
+        """
+        Push the upcoming events to the subscribers, e.g. after a sync
+        """
+        if not self._subscribers:
+            return
+        message = self._encode(self._events(self.calendar.index.overlapping(time.time(), math.inf)))
+        for client in list(self._subscribers):
+            self._send(client, message)
+
+    def _on_accept(self, fd, condition):
+        from gi.repository import GLib
+
+        try:
+            client, _ = self._server.accept()
+        except OSError:
+            return True
+        client.setblocking(False)
+        watch = GLib.io_add_watch(client.fileno(), GLib.PRIORITY_DEFAULT,
+                                  GLib.IO_IN | GLib.IO_HUP | GLib.IO_ERR, self._on_readable, client)
+        self._clients[client] = [b"", watch]
+        return True
+
+    def _on_readable(self, fd, condition, client):
+        try:
+            data = client.recv(4096)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""
+        if not data:
+            self._close(client, remove_watch=False)
+            return False
+
+        state = self._clients[client]
+        state[0] += data
+        while b"\n" in state[0] and client in self._clients:
+            line, state[0] = state[0].split(b"\n", 1)
+            if line.strip():
+                self._send(client, self._encode(self.handle(line, client)))
+        if len(state[0]) > self.MAX_REQUEST:
+            self._close(client, remove_watch=False)
+            return False
+        return client in self._clients
+
+    def handle(self, line, client=None):
+        """
+        Answer one request line of `client`, returns the reply object
+        """
+        try:
+            request = json.loads(line)
+            query = request.get("query", None)
+            index = self.calendar.index
+            if query == "next":
+                count = int(request.get("count", self.DEFAULT_COUNT))
+                return self._events(index.overlapping(time.time(), math.inf)[:count])
+            if query == "today":
+                return self._events(index.on_date(date.today()))
+            if query == "range":
+                start = self._parse_time(request["start"])
+                end = self._parse_time(request["end"])
+                return self._events(index.overlapping(start, end))
+            if query == "subscribe" and client is not None:
+                self._subscribers.add(client)
+                return self._events(index.overlapping(time.time(), math.inf))
+            return {"error": f"Unknown query {query!r}"}
+        except (ValueError, KeyError, TypeError, AttributeError) as err:
+            return {"error": f"Invalid request: {err}"}
+
+    def _send(self, client, message):
+        try:
+            client.sendall(message)
+        except OSError:
+            # Includes a full send buffer, the client is not reading its updates
+            self._close(client)
+
+    def _close(self, client, remove_watch=True):
+        state = self._clients.pop(client, None)
+        if state is not None and remove_watch:
+            from gi.repository import GLib
+            GLib.source_remove(state[1])
+        self._subscribers.discard(client)
+        client.close()
+
+    @staticmethod
+    def _events(events):
+        return {"events": [event.to_dict() for event in events]}
+
+    @staticmethod
+    def _encode(reply):
+        return (json.dumps(reply) + "\n").encode()
+
+    @staticmethod
+    def _parse_time(value):
+        """
+        Timestamp of an ISO 8601 date or time, local when it has no offset
+        """
+        dt = datetime.fromisoformat(value)
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=tzlocal())
+        return dt.timestamp()
@@ -0,0 +1,81 @@
+from datetime import datetime
+import time
+
+
+class RefreshPolicy:
+    """
+    Chooses the delay before the next agenda sync.
+    The change rate of each calendar is an exponentially weighted moving average of the
+    events changed per hour, as measured by incremental syncs. The delay aims for about one
+    change per sync within [MIN_INTERVAL, MAX_INTERVAL], and is capped during working hours
+    and while an event is about to start, so idle nights cost few requests and busy
+    mornings stay fresh.
+    Failures are backed off by Agenda, per provider: the delay is shortened to the next retry
+    of a failed provider, and a sync that reached no calendar tells nothing about the change rates.
+    """
+
+    MIN_INTERVAL = 5 * 60  # Seconds
+    MAX_INTERVAL = 60 * 60  # Seconds
+    WORKING_HOURS = (8, 18)  # Local hours [start, end) of working days
+    WORKING_DAYS = range(5)  # Monday to Friday
+    WORKING_HOURS_INTERVAL = 15 * 60  # Max seconds between syncs during working hours
+    UPCOMING_WINDOW = 60 * 60  # Seconds before an event starts during which it is considered upcoming
+    UPCOMING_INTERVAL = 10 * 60  # Max seconds between syncs while an event is upcoming
+    RATE_WEIGHT = 0.3  # Weight of the latest measurement in the change rates
+
+    def __init__(self):
+        self.interval = self.WORKING_HOURS_INTERVAL  # Seconds chosen by the last next_interval()
+        self.reason = "default"  # Why that interval was chosen
+        self._rates = {}  # calendar id -> changed events per hour
+        self._last_success = None  # time.time() of the last sync that reached a calendar
+
+    def record_sync(self, changes):
+        """
+        Record the number of changed events of each calendar a sync reached (None for full syncs,
+        which do not tell how much changed). A sync that reached none, e.g. because every provider
+        failed or was backed off, is ignored.
+        """
+        if not changes:
+            return
+        now = time.time()
+
+        if self._last_success is not None and now > self._last_success:
+            hours = (now - self._last_success) / (60 * 60)
+            for calendar_id, count in changes.items():
+                if count is None:
+                    continue
+                rate = count / hours
+                previous = self._rates.get(calendar_id, None)
+                self._rates[calendar_id] = rate if previous is None else \
+                    self.RATE_WEIGHT * rate + (1 - self.RATE_WEIGHT) * previous
+        self._last_success = now
+
+    def next_interval(self, index, retry_delay=None):
+        """
+        Return the seconds until the next sync, given the EventIndex of the loaded events and the
+        seconds until the next retry of a failed provider (see Agenda.retry_delay()), if any
+        """
+        now = time.time()
+        interval, reason = self.MAX_INTERVAL, "idle"
+        rate = sum(self._rates.values())
+        if rate > 0 and 60 * 60 / rate < interval:
+            interval, reason = 60 * 60 / rate, f"{rate:.1f} changes per hour"
+
+        local = datetime.now()
+        if local.weekday() in self.WORKING_DAYS and self.WORKING_HOURS[0] <= local.hour < self.WORKING_HOURS[1] \
+                and interval > self.WORKING_HOURS_INTERVAL:
+            interval, reason = self.WORKING_HOURS_INTERVAL, "working hours"
+
+        upcoming = next((event for event in index.starting_after(now) if not event.all_day), None)
+        if upcoming is not None and upcoming.start.timestamp() - now < self.UPCOMING_WINDOW \
+                and interval > self.UPCOMING_INTERVAL:
+            interval, reason = self.UPCOMING_INTERVAL, "upcoming event"
+        interval = max(self.MIN_INTERVAL, interval)
+
+        # Backed off retries may come sooner than MIN_INTERVAL
+        if retry_delay is not None and retry_delay < interval:
+            interval, reason = max(1, retry_delay), "retrying failed calendars"
+
+        self.interval = interval
+        self.reason = reason
+        return interval
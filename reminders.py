@@ -0,0 +1,117 @@
+import heapq
+import time
+import gi
+from gi.repository import GLib
+
+try:
+    gi.require_version("Notify", "0.7")
+    from gi.repository import Notify
+except (ImportError, ValueError):
+    Notify = None  # libnotify is not installed, reminders are only printed
+
+NOTIFY_TIME_FORMAT = "%-I:%M %p"
+
+
+class ReminderScheduler:
+    """
+    Shows desktop notifications for the popup reminders of the loaded events.
+    All pending reminder times are kept in a min-heap and a single GLib timeout is armed
+    for the earliest one. When the events change, only reminders that were added or
+    removed are touched; heap entries of removed reminders are skipped when they surface.
+    Reminders that were missed because the timeout fired late (e.g. after suspend) are
+    still shown as long as their event has not started.
+    """
+
+    APP_NAME = "Desktop Agenda"
+    ICON_NAME = "gnome-calendar"
+    MAX_SLEEP = 60 * 60  # Re-arm at least hourly so GLib timeouts never overflow
+
+    def __init__(self):
+        self._heap = []  # (reminder timestamp, sequence number, key)
+        self._pending = {}  # key -> (reminder timestamp, event) of reminders not shown yet
+        self._shown = set()  # keys of reminders already shown
+        self._seq = 0
+        self._timer = None
+        if Notify is not None:
+            Notify.init(self.APP_NAME)
+
+    def set_events(self, index):
+        """
+        Schedule the popup reminders of the events in the given EventIndex
+        """
+        now = time.time()
+        wanted = {}
+        for event in index.starting_after(now):
+            if event.all_day:
+                continue
+            start = event.start.timestamp()
+            for minutes in event.reminders:
+                # Moving an event changes the key, so its reminders are scheduled again
+                key = (event.calendar_id, event.id, start, minutes)
+                wanted[key] = (start - minutes * 60, event)
+
+        for key in [key for key in self._pending if key not in wanted]:
+            del self._pending[key]
+        for key, reminder in wanted.items():
+            if key in self._shown:
+                continue
+            if key not in self._pending:
+                self._push(reminder[0], key)
+            self._pending[key] = reminder  # Keep the latest summary and location
+        self._shown.intersection_update(wanted)
+
+        # Drop the entries of removed reminders once they outnumber the pending ones
+        if len(self._heap) > 2 * len(self._pending) + 16:
+            self._heap = [entry for entry in self._heap if entry[2] in self._pending]
+            heapq.heapify(self._heap)
+
+        self.rearm()
+
+    def rearm(self):
+        """
+        Arm the timeout for the next due reminder.
+        Call this after the system clock jumped or the system resumed from suspend.
+        """
+        if self._timer is not None:
+            GLib.source_remove(self._timer)
+            self._timer = None
+
+        while self._heap and self._heap[0][2] not in self._pending:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return
+
+        delay = min(max(self._heap[0][0] - time.time(), 0), self.MAX_SLEEP)
+        self._timer = GLib.timeout_add(int(delay * 1000), self._on_timer)
+
+    def _push(self, when, key):
+        self._seq += 1
+        heapq.heappush(self._heap, (when, self._seq, key))
+
+    def _on_timer(self):
+        self._timer = None
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            when, seq, key = heapq.heappop(self._heap)
+            reminder = self._pending.pop(key, None)
+            if reminder is None:
+                continue  # Removed since it was scheduled
+            self._shown.add(key)
+            event = reminder[1]
+            if event.start.timestamp() > now:
+                self._show(event)
+        self.rearm()
+        return False  # One-shot timeout, rearm() creates the next one
+
+    def _show(self, event):
+        body = "Starts at {}".format(event.start.strftime(NOTIFY_TIME_FORMAT))
+        if event.location is not None:
+            body = "{}\n{}".format(body, event.location)
+
+        if Notify is None:
+            print(f"Reminder: {event.summary} - {body}")
+            return
+        try:
+            Notify.Notification.new(event.summary, body, self.ICON_NAME).show()
+        except GLib.Error as err:
+            print(f"Failed to show reminder notification: {err}")
@@ -0,0 +1,87 @@
+import threading
+from gi.repository import GLib
+
+
+class SyncWorker:
+    """
+    Background thread that owns all Calendar API requests for the Desktop Agenda application.
+    Only one fetch runs at a time. A request that arrives while a fetch is running is
+    merged into it when the running fetch already covers it, otherwise all such requests
+    are coalesced into a single follow-up fetch.
+    Finished, sorted event lists are handed back to the GTK main loop with GLib.idle_add
+    so widgets are only ever touched from the UI thread. Partial event lists reported while
+    a fetch is still running are handed to `on_progress` the same way.
+    """
+
+    def __init__(self, calendar, on_loaded, on_progress=None):
+        self._calendar = calendar
+        self._on_loaded = on_loaded
+        self._on_progress = on_progress
+        self._cond = threading.Condition()
+        self._pending = None  # (days, max_results) of the next fetch
+        self._running = None  # (days, max_results) of the fetch in progress
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="calendar-sync", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def request(self, days, max_results):
+        """
+        Ask for the events of the next `days` days to be fetched.
+        Safe to call from any thread; never blocks on network I/O.
+        """
+        with self._cond:
+            running = self._running
+            if running is not None and self._pending is None \
+                    and running[0] >= days and running[1] >= max_results:
+                return  # Merged into the fetch in progress
+            if self._pending is not None:
+                days = max(days, self._pending[0])
+                max_results = max(max_results, self._pending[1])
+            self._pending = (days, max_results)
+            self._cond.notify()
+
+    def is_busy(self):
+        with self._cond:
+            return self._running is not None or self._pending is not None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                self._running = self._pending
+                self._pending = None
+                days, max_results = self._running
+
+            events = None
+            try:
+                events = self._calendar.fetch_events(days=days, max_results=max_results,
+                                                     on_progress=self._progress if self._on_progress else None)
+            except Exception as err:
+                print(f"Calendar sync failed: {err}")
+
+            with self._cond:
+                self._running = None
+
+            if events is not None:
+                GLib.idle_add(self._deliver, events)
+
+    def _deliver(self, events):
+        self._on_loaded(events)
+        return False  # Run once
+
+    def _progress(self, events):
+        GLib.idle_add(self._deliver_progress, events)
+
+    def _deliver_progress(self, events):
+        self._on_progress(events)
+        return False  # Run once
@@ -0,0 +1,99 @@
+from datetime import datetime
+import time
+from gi.repository import Gio, GLib
+
+
+class WallClockTimers:
+    """
+    Periodic callbacks aligned to wall-clock boundaries, e.g. the start of every minute.
+    Each timer is a one-shot GLib timeout armed for its next boundary, so the process
+    only wakes up when there is something to do.
+    GLib timeouts follow the monotonic clock, which does not advance while the system is
+    suspended. Clock jumps and resumes are detected by comparing elapsed wall time with
+    elapsed monotonic time whenever a timer fires, and immediately through the logind
+    PrepareForSleep signal when it is available. Resume handlers are then called and
+    all timers are re-armed.
+    """
+
+    JUMP_THRESHOLD = 5  # Seconds of disagreement between the wall and monotonic clocks
+    SLACK = 0.05  # Seconds added to each delay so callbacks never run before the boundary
+
+    def __init__(self):
+        self._timers = {}  # name -> [period, callback, source id]
+        self._resume_handlers = []
+        self._wall = time.time()
+        self._monotonic = time.monotonic()
+        self._subscribe_sleep_signal()
+
+    def add(self, name, period, callback):
+        """
+        Call `callback` at every multiple of `period` seconds of local time
+        """
+        self.remove(name)
+        self._timers[name] = [period, callback, None]
+        self._arm(name)
+
+    def remove(self, name):
+        timer = self._timers.pop(name, None)
+        if timer is not None and timer[2] is not None:
+            GLib.source_remove(timer[2])
+
+    def on_resume(self, callback):
+        """
+        Call `callback` when the system resumes from suspend or the wall clock jumps
+        """
+        self._resume_handlers.append(callback)
+
+    def _arm(self, name):
+        timer = self._timers[name]
+        if timer[2] is not None:
+            GLib.source_remove(timer[2])
+        now = datetime.now()
+        seconds = now.hour * 3600 + now.minute * 60 + now.second + now.microsecond / 1000000
+        delay = timer[0] - seconds % timer[0] + self.SLACK
+        timer[2] = GLib.timeout_add(int(delay * 1000), self._fire, name)
+
+    def _fire(self, name):
+        timer = self._timers.get(name, None)
+        if timer is None:
+            return False
+        timer[2] = None
+
+        if self._clock_jumped():
+            self._resumed()
+        else:
+            timer[1]()
+            if name in self._timers:
+                self._arm(name)
+        return False  # One-shot timeout, _arm() creates the next one
+
+    def _clock_jumped(self):
+        wall = time.time()
+        monotonic = time.monotonic()
+        drift = (wall - self._wall) - (monotonic - self._monotonic)
+        self._wall = wall
+        self._monotonic = monotonic
+        return abs(drift) > self.JUMP_THRESHOLD
+
+    def _resumed(self):
+        self._wall = time.time()
+        self._monotonic = time.monotonic()
+        for handler in self._resume_handlers:
+            handler()
+        for name in list(self._timers):
+            self._timers[name][1]()
+            self._arm(name)
+
+    def _subscribe_sleep_signal(self):
+        try:
+            bus = Gio.bus_get_sync(Gio.BusType.SYSTEM, None)
+            bus.signal_subscribe("org.freedesktop.login1", "org.freedesktop.login1.Manager", "PrepareForSleep",
+                                 "/org/freedesktop/login1", None, Gio.DBusSignalFlags.NONE,
+                                 self._on_prepare_for_sleep)
+        except GLib.Error as err:
+            print(f"Failed to watch for system resume, relying on clock jump detection: {err}")
+
+    def _on_prepare_for_sleep(self, connection, sender, path, interface, signal, parameters):
+        going_to_sleep = parameters.unpack()[0]
+        if not going_to_sleep:
+            self._resumed()